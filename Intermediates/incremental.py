@@ -0,0 +1,38 @@
+import os
+
+import pandas as pd
+
+# Row-level change tracking shared by the steps that only redo what changed upstream (3, 4, 5).
+# Step2 stamps every deposit with Updated_At; downstream rows carry it along, so a row is
+# current exactly when its (Lens_ID, Accession_ID) still exists upstream at the same Updated_At.
+
+def row_keys(df: pd.DataFrame) -> pd.Series:
+    return df['Lens_ID'].astype(str) + "_" + df['Accession_ID'].astype(str)
+
+def current_versions(df_input: pd.DataFrame) -> dict:
+    """key -> Updated_At of the upstream rows (normalising a missing/NaN Updated_At to "")."""
+    if 'Updated_At' not in df_input.columns: df_input['Updated_At'] = ""
+    df_input['Updated_At'] = df_input['Updated_At'].fillna("").astype(str)
+    return dict(zip(row_keys(df_input), df_input['Updated_At']))
+
+def still_current(df_done: pd.DataFrame, versions: dict) -> pd.Series:
+    """Mask of output rows whose asset is still upstream, at the version they were processed at."""
+    if 'Updated_At' not in df_done.columns: df_done['Updated_At'] = ""
+    return row_keys(df_done).map(versions) == df_done['Updated_At'].fillna("").astype(str)
+
+def prune_stale_output(df_done: pd.DataFrame, versions: dict, output_file: str, output_columns: list) -> set:
+    """
+    Drops output rows whose asset left the input (e.g. REINSTATED) or changed upstream
+    since it was processed, rewriting output_file if needed. Returns the keys still valid.
+    """
+    valid = still_current(df_done, versions)
+    keys = row_keys(df_done)
+
+    if not valid.all():
+        tmp_file = output_file + ".tmp"
+        df_done[valid].reindex(columns=output_columns, fill_value="").to_csv(tmp_file, index=False)
+        os.replace(tmp_file, output_file)
+        print(f"[*] Dropped {(~valid).sum()} stale/removed rows from {output_file}")
+    elif list(df_done.columns) != output_columns:
+        df_done.reindex(columns=output_columns, fill_value="").to_csv(output_file, index=False)
+    return set(keys[valid])
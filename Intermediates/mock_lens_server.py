@@ -0,0 +1,347 @@
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from synthetic_corpus import SEED, synthetic_patents
+
+# Offline stand-in for https://api.lens.org/patent/search, covering the subset steps 1-3 use:
+# bool/terms/term/match_phrase/wildcard/range/exists queries, size, include, scroll,
+# and date_histogram aggregations. Run the steps against it with
+#   LENS_API_URL=http://127.0.0.1:8800/patent/search python step2_fetch_and_store_accession_numbers.py
+
+DEFAULT_PORT = 8800
+SEARCH_PATH = "/patent/search"
+SYNTHETIC_PATENTS = 5000
+MAX_SIZE = 1000             # Lens caps size per request
+DEFAULT_SCROLL_TTL_S = 120
+
+# ---------------------------------------------------------------- fixtures
+
+def load_fixtures(path: str) -> List[dict]:
+    """A recorded Lens response ({"data": [...]}), a JSON list, or JSON lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data.get("data", []) if isinstance(data, dict) else data
+
+# ---------------------------------------------------------------- query evaluation
+
+def field_values(doc: dict, path: str) -> list:
+    """Every value at a dotted path; lists along the way are flattened (class_ipc.symbol)."""
+    if path == "full_text":
+        return [doc["_full_text"]]
+    values = [doc]
+    for part in path.split("."):
+        next_values = []
+        for v in values:
+            if isinstance(v, list):
+                next_values.extend(x.get(part) for x in v if isinstance(x, dict))
+            elif isinstance(v, dict):
+                next_values.append(v.get(part))
+        values = [v for v in next_values if v is not None]
+    flat = []
+    for v in values:
+        flat.extend(v) if isinstance(v, list) else flat.append(v)
+    return flat
+
+def matches(doc: dict, query: dict) -> bool:
+    if not query or "match_all" in query:
+        return True
+    (kind, body), = query.items()
+
+    if kind == "bool":
+        must = body.get("must", []) + body.get("filter", [])
+        should = body.get("should", [])
+        must_not = body.get("must_not", [])
+        if isinstance(must, dict): must = [must]
+        if isinstance(should, dict): should = [should]
+        if isinstance(must_not, dict): must_not = [must_not]
+        if not all(matches(doc, q) for q in must): return False
+        if any(matches(doc, q) for q in must_not): return False
+        if should:
+            needed = body.get("minimum_should_match", 0 if must else 1)
+            if sum(matches(doc, q) for q in should) < needed: return False
+        return True
+
+    (field, arg), = body.items()
+    values = field_values(doc, field)
+    if kind == "terms":
+        wanted = {str(a) for a in arg}
+        return any(str(v) in wanted for v in values)
+    if kind == "term":
+        arg = arg.get("value") if isinstance(arg, dict) else arg
+        return any(str(v) == str(arg) for v in values)
+    if kind == "match_phrase":
+        phrase = (arg.get("query") if isinstance(arg, dict) else arg).lower()
+        return any(phrase in str(v).lower() for v in values)
+    if kind == "wildcard":
+        pattern = arg.get("value") if isinstance(arg, dict) else arg
+        return any(fnmatch.fnmatchcase(str(v), pattern) for v in values)
+    if kind == "exists":
+        return bool(field_values(doc, arg))
+    if kind == "range":
+        for v in values:
+            v = str(v)[:10]
+            if "gte" in arg and v < arg["gte"]: continue
+            if "gt" in arg and v <= arg["gt"]: continue
+            if "lte" in arg and v > arg["lte"]: continue
+            if "lt" in arg and v >= arg["lt"]: continue
+            return True
+        return False
+    raise ValueError(f"Unsupported query clause: {kind}")
+
+def project(doc: dict, include: Optional[List[str]]) -> dict:
+    if not include:
+        return {k: v for k, v in doc.items() if not k.startswith("_")}
+    return {k: doc[k] for k in include if k in doc}
+
+def date_histogram(docs: List[dict], spec: dict) -> dict:
+    width = {"year": 4, "month": 7, "day": 10}[spec.get("interval") or spec.get("calendar_interval") or "year"]
+    counts = {}
+    for doc in docs:
+        for v in field_values(doc, spec["field"])[:1]:
+            key = str(v)[:width]
+            counts[key] = counts.get(key, 0) + 1
+    buckets = []
+    for key in sorted(counts):
+        start = (key + "-01-01")[:10] if width == 4 else (key + "-01")[:10]
+        epoch_ms = int(datetime.datetime.strptime(start, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        buckets.append({"key": epoch_ms, "key_as_string": start, "doc_count": counts[key]})
+    return {"buckets": buckets}
+
+def parse_ttl(value) -> float:
+    m = re.fullmatch(r"(\d+)([smh]?)", str(value or ""))
+    if not m: return DEFAULT_SCROLL_TTL_S
+    return int(m.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[m.group(2)]
+
+# ---------------------------------------------------------------- server
+
+class MockLens:
+    """
+    Patent store plus fault injection. Every request first waits latency_ms (+/- jitter),
+    then may be answered 429 / 5xx at the configured rates; scroll contexts expire after
+    their requested keep-alive (capped by scroll_ttl) or at random with expire_rate.
+    """
+    def __init__(self, patents: List[dict], latency_ms: float = 0, jitter_ms: float = 0, rate_429: float = 0,
+                 rate_5xx: float = 0, rate_limit_per_min: int = 0, scroll_ttl: Optional[float] = None,
+                 expire_rate: float = 0, api_key: str = "", seed: int = SEED):
+        self.patents = patents
+        for doc in patents:
+            claims = " ".join(str(v) for v in field_values(doc, "claims.claims.claim_text"))
+            title = " ".join(str(v) for v in field_values(doc, "biblio.invention_title.text"))
+            doc["_full_text"] = " ".join([title, doc.get("description", {}).get("text", ""), claims])
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_limit_per_min = rate_limit_per_min
+        self.scroll_ttl = scroll_ttl
+        self.expire_rate = expire_rate
+        self.api_key = api_key
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.scrolls = {}
+        self.recent_calls = []
+        self.started = time.time()
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "server_errors": 0, "bad_requests": 0,
+                      "scrolls_opened": 0, "scrolls_expired": 0, "docs_served": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] += n
+
+    def inject_fault(self) -> Optional[tuple]:
+        """(status, payload, headers) for an injected failure, or None."""
+        with self.lock:
+            now = time.time()
+            if self.rate_limit_per_min:
+                self.recent_calls = [t for t in self.recent_calls if now - t < 60]
+                if len(self.recent_calls) >= self.rate_limit_per_min:
+                    retry_after = max(1, int(60 - (now - self.recent_calls[0])) + 1)
+                    return 429, {"error": "Rate limit exceeded"}, {"Retry-After": str(retry_after)}
+                self.recent_calls.append(now)
+            roll = self.rng.random()
+        if roll < self.rate_429:
+            return 429, {"error": "Too Many Requests"}, {"Retry-After": "1"}
+        if roll < self.rate_429 + self.rate_5xx:
+            return self.rng.choice([500, 502, 503, 504]), {"error": "Injected server error"}, {}
+        return None
+
+    def search(self, request: dict) -> tuple:
+        """(status, payload) for one POST body."""
+        if "scroll_id" in request:
+            return self.continue_scroll(request)
+
+        hits = [doc for doc in self.patents if matches(doc, request.get("query", {}))]
+        size = min(int(request.get("size", 10)), MAX_SIZE)
+        response = {"total": len(hits)}
+        for name, agg in (request.get("aggregations") or request.get("aggs") or {}).items():
+            if "date_histogram" not in agg:
+                raise ValueError(f"Unsupported aggregation in '{name}'")
+            response.setdefault("aggregations", {})[name] = date_histogram(hits, agg["date_histogram"])
+
+        page = hits[int(request.get("from", 0)):][:size]
+        include = request.get("include")
+        response["data"] = [project(doc, include) for doc in page]
+        response["results"] = len(page)
+
+        if request.get("scroll") and size > 0:
+            scroll_id = uuid.uuid4().hex
+            with self.lock:
+                self.scrolls[scroll_id] = {"hits": hits, "offset": len(page), "size": size, "include": include,
+                                           "expires": self._expiry(request["scroll"])}
+            self._count("scrolls_opened")
+            response["scroll_id"] = scroll_id
+        self._count("docs_served", len(page))
+        return 200, response
+
+    def _expiry(self, keep_alive) -> float:
+        ttl = parse_ttl(keep_alive)
+        if self.scroll_ttl is not None: ttl = min(ttl, self.scroll_ttl)
+        return time.time() + ttl
+
+    def continue_scroll(self, request: dict) -> tuple:
+        with self.lock:
+            context = self.scrolls.get(request["scroll_id"])
+            expired = context is None or time.time() > context["expires"] or self.rng.random() < self.expire_rate
+            if expired:
+                self.scrolls.pop(request["scroll_id"], None)
+            else:
+                page = context["hits"][context["offset"]:context["offset"] + context["size"]]
+                context["offset"] += len(page)
+                context["expires"] = self._expiry(request.get("scroll"))
+        if expired:
+            self._count("scrolls_expired")
+            return 400, {"error": "Scroll context expired or unknown scroll_id"}
+        self._count("docs_served", len(page))
+        return 200, {"total": len(context["hits"]), "scroll_id": request["scroll_id"], "results": len(page),
+                     "data": [project(doc, context["include"]) for doc in page]}
+
+    def status(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["open_scrolls"] = len(self.scrolls)
+        elapsed = time.time() - self.started
+        stats["uptime_s"] = round(elapsed, 1)
+        stats["docs_per_s"] = round(stats["docs_served"] / max(elapsed, 1e-9), 1)
+        stats["patents"] = len(self.patents)
+        return stats
+
+def make_handler(lens: MockLens):
+    class LensHandler(BaseHTTPRequestHandler):
+        """
+        POST /patent/search  Lens search / scroll request -> Lens-shaped response
+        GET  /health, /stats
+        """
+        def _send(self, code, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok", "patents": len(lens.patents)})
+            elif self.path == "/stats":
+                self._send(200, lens.status())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.split("?")[0] != SEARCH_PATH:
+                self._send(404, {"error": "not found"})
+                return
+            lens._count("requests")
+            if lens.api_key and self.headers.get("Authorization") != f"Bearer {lens.api_key}":
+                self._send(401, {"error": "Invalid API key"})
+                return
+
+            delay_ms = lens.latency_ms + (lens.rng.uniform(-lens.jitter_ms, lens.jitter_ms) if lens.jitter_ms else 0)
+            if delay_ms > 0: time.sleep(delay_ms / 1000)
+
+            fault = lens.inject_fault()
+            if fault:
+                code, payload, headers = fault
+                lens._count("throttled" if code == 429 else "server_errors")
+                self._send(code, payload, headers)
+                return
+
+            try:
+                code, payload = lens.search(json.loads(body))
+            except (ValueError, KeyError, TypeError) as e:
+                lens._count("bad_requests")
+                self._send(400, {"error": str(e)})
+                return
+            lens._count("ok" if code == 200 else "bad_requests")
+            self._send(code, payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return LensHandler
+
+def serve(lens: MockLens, port: int = DEFAULT_PORT):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(lens))
+    print(f"[*] Mock Lens API: {len(lens.patents)} patents on http://127.0.0.1:{port}{SEARCH_PATH}")
+    print(f"    export LENS_API_URL=http://127.0.0.1:{port}{SEARCH_PATH}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n[*] Stats: {json.dumps(lens.status())}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Lens patent search API.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--fixtures", help="Recorded patents: Lens response JSON, JSON list or JSON lines")
+    parser.add_argument("--synthetic", type=int, default=SYNTHETIC_PATENTS, help="Synthetic patents to generate when no --fixtures")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--dump-fixtures", metavar="PATH", help="Write the patent set as JSON lines and exit")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Uniform +/- jitter on the delay")
+    parser.add_argument("--rate-429", type=float, default=0, help="Fraction of requests answered 429")
+    parser.add_argument("--rate-5xx", type=float, default=0, help="Fraction of requests answered 500/502/503/504")
+    parser.add_argument("--rate-limit-per-min", type=int, default=0, help="Sliding-window limit; excess requests get 429")
+    parser.add_argument("--scroll-ttl", type=float, help="Cap scroll keep-alive at this many seconds")
+    parser.add_argument("--expire-rate", type=float, default=0, help="Fraction of scroll continuations answered as expired")
+    parser.add_argument("--api-key", default="", help="Require this bearer token (default: accept any)")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        if not os.path.exists(args.fixtures):
+            print(f"[!] Fixture file {args.fixtures} not found.")
+            sys.exit(1)
+        patents = load_fixtures(args.fixtures)
+    else:
+        patents = synthetic_patents(args.synthetic, args.seed)
+
+    if args.dump_fixtures:
+        with open(args.dump_fixtures, "w", encoding="utf-8") as f:
+            for doc in patents: f.write(json.dumps(doc) + "\n")
+        print(f"[*] Wrote {len(patents)} patents to {args.dump_fixtures}")
+        sys.exit(0)
+
+    lens = MockLens(patents, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+                    rate_5xx=args.rate_5xx, rate_limit_per_min=args.rate_limit_per_min, scroll_ttl=args.scroll_ttl,
+                    expire_rate=args.expire_rate, api_key=args.api_key, seed=args.seed)
+    serve(lens, args.port)
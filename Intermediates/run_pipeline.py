@@ -0,0 +1,401 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import METRICS_PORT, init, inc, span
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = ".pipeline_state.json"
+LOG_DIR = ".pipeline_logs"
+HASH_CHUNK_SIZE = 1024 * 1024
+MAX_WORKERS = 2
+
+# The DAG. File names and parameters are NOT repeated here: "inputs"/"outputs"/"params"
+# name module-level constants that are read straight out of each script, so the
+# scripts stay the single source of truth.
+#
+# mode:
+#   "append"    - script appends to an existing output, so a rebuild starts from a clean file
+#   "resume"    - script skips rows already in its output; kept across input changes, cleared
+#                 when the script or its parameters change (old rows would be stale)
+#   "overwrite" - script rewrites its outputs from scratch
+#
+# "delta_args" marks a stage that can refresh itself incrementally from its external
+# source; `--delta` re-runs it with those arguments and lets the change flow downstream.
+STAGES = {
+    "step1": {
+        "script": "step1_total_count_check.py",
+        "deps": [],
+        "inputs": [],
+        "outputs": [],
+        "params": ["BIO_IPC_PATTERNS", "DEPOSIT_KEYWORDS", "API_URL"],
+        "mode": "overwrite",
+    },
+    "step2": {
+        "script": "step2_fetch_and_store_accession_numbers.py",
+        "deps": [],
+        "inputs": [],
+        "outputs": ["OUTPUT_FILE"],
+        "params": ["BATCH_SIZE", "API_URL", "CUSTOM_IDA_PATTERNS", "STANDARD_IDA_ACRONYMS"],
+        "mode": "append",
+        "delta_args": ["--delta"],
+    },
+    "step3": {
+        "script": "step3_add_context_snippet_of_open_source_non_duplicates.py",
+        "deps": ["step2"],
+        "inputs": ["INPUT_FILE"],
+        "outputs": ["OUTPUT_FILE"],
+        "params": ["CONTEXT_WINDOW", "BATCH_SIZE", "API_URL"],
+        "mode": "resume",
+    },
+    "step4": {
+        "script": "step4_LLM_extraction.py",
+        "deps": ["step3"],
+        "inputs": ["INPUT_FILE"],
+        "outputs": ["OUTPUT_FILE"],
+        "params": ["MODEL_NAME"],
+        "mode": "resume",
+    },
+    "step5": {
+        "script": "step5_LLM_results_refining.py",
+        "deps": ["step4"],
+        "inputs": ["INPUT_FILE"],
+        "outputs": ["OUTPUT_FILE"],
+        "params": [],
+        "mode": "resume",
+    },
+    "step6": {
+        "script": "step6_FAISS_embeddings.py",
+        "deps": ["step5"],
+        "inputs": ["INPUT_FILE"],
+        "outputs": ["INDEX_FILE", "META_FILE"],
+        "params": ["MODEL_NAME", "BATCH_SIZE", "VECTOR_DTYPE"],
+        "mode": "overwrite",
+    },
+}
+
+def read_script_constants(script_path: str) -> Dict[str, object]:
+    """
+    Reads literal module-level constants (FOO = "bar") from a step script
+    without importing it, so heavy dependencies (torch, langchain) are never loaded.
+    """
+    with open(script_path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=script_path)
+
+    constants = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign): continue
+        for target in node.targets:
+            if isinstance(target, ast.Name) and target.id.isupper():
+                try:
+                    env_default = _environ_get_args(node.value)
+                    if env_default:
+                        # os.environ.get("LENS_API_URL", "...") resolves as the step will see it
+                        constants[target.id] = os.environ.get(*env_default)
+                    else:
+                        constants[target.id] = ast.literal_eval(node.value)
+                except ValueError:
+                    # Computed values (e.g. list concatenation) fall back to their source text
+                    constants[target.id] = ast.unparse(node.value)
+    return constants
+
+def _environ_get_args(value: ast.AST) -> Optional[tuple]:
+    """(name, default) if value is os.environ.get(<literal>, <literal>), else None."""
+    if (isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute) and value.func.attr == "get"
+            and ast.unparse(value.func.value) == "os.environ" and len(value.args) == 2):
+        return tuple(ast.literal_eval(arg) for arg in value.args)
+    return None
+
+class HashCache:
+    """
+    sha256 of file contents, memoised on (size, mtime) so multi-GB CSVs are only re-read when they change.
+    """
+    def __init__(self, entries: Optional[dict] = None):
+        self.entries = entries or {}
+
+    def file_hash(self, path: str) -> Optional[str]:
+        if not os.path.exists(path): return None
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.entries.get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.entries[key] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+def load_state() -> dict:
+    path = os.path.join(PIPELINE_DIR, STATE_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"[!] Warning: {STATE_FILE} unreadable. Treating every stage as stale.")
+    return {"stages": {}, "hash_cache": {}}
+
+def save_state(state: dict):
+    path = os.path.join(PIPELINE_DIR, STATE_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def resolve_stage(name: str) -> dict:
+    """Expands a stage declaration into concrete file names and parameter values."""
+    spec = STAGES[name]
+    script_path = os.path.join(PIPELINE_DIR, spec["script"])
+    constants = read_script_constants(script_path)
+
+    def lookup(const):
+        if const not in constants:
+            raise KeyError(f"{spec['script']} does not define {const}")
+        return constants[const]
+
+    return {
+        "name": name,
+        "script": script_path,
+        "deps": spec["deps"],
+        "inputs": [lookup(c) for c in spec["inputs"]],
+        "outputs": [lookup(c) for c in spec["outputs"]],
+        "params": {c: lookup(c) for c in spec["params"]},
+        "mode": spec["mode"],
+        "delta_args": spec.get("delta_args"),
+    }
+
+def validate_dag(resolved: Dict[str, dict]):
+    """Every file a stage reads must be written by one of its declared dependencies."""
+    for name, stage in resolved.items():
+        produced = {out for dep in stage["deps"] for out in resolved[dep]["outputs"]}
+        for inp in stage["inputs"]:
+            if inp not in produced:
+                raise ValueError(f"{name} reads '{inp}' but none of {stage['deps']} write it (produced: {sorted(produced)})")
+
+def topological_order(resolved: Dict[str, dict]) -> List[str]:
+    order, seen = [], set()
+    def visit(name, path=()):
+        if name in path: raise ValueError(f"Cycle in pipeline: {' -> '.join(path + (name,))}")
+        if name in seen: return
+        for dep in resolved[name]["deps"]: visit(dep, path + (name,))
+        seen.add(name)
+        order.append(name)
+    for name in resolved: visit(name)
+    return order
+
+def fingerprint_stage(stage: dict, hashes: HashCache) -> dict:
+    inputs = {inp: hashes.file_hash(os.path.join(PIPELINE_DIR, inp)) for inp in stage["inputs"]}
+    parts = {
+        "script": hashes.file_hash(stage["script"]),
+        "params": hashlib.sha256(json.dumps(stage["params"], sort_keys=True, default=str).encode()).hexdigest(),
+        "inputs": inputs,
+    }
+    parts["fingerprint"] = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return parts
+
+def stale_reasons(stage: dict, parts: dict, record: Optional[dict], hashes: HashCache) -> List[str]:
+    if any(h is None for h in parts["inputs"].values()):
+        missing = [f for f, h in parts["inputs"].items() if h is None]
+        return [f"missing input {', '.join(missing)}"]
+    if not record: return ["never built"]
+
+    reasons = []
+    if record.get("script") != parts["script"]: reasons.append("script changed")
+    if record.get("params") != parts["params"]: reasons.append("parameters changed")
+    for inp, h in parts["inputs"].items():
+        if record.get("inputs", {}).get(inp) != h: reasons.append(f"input {inp} changed")
+    for out, h in record.get("outputs", {}).items():
+        current = hashes.file_hash(os.path.join(PIPELINE_DIR, out))
+        if current is None: reasons.append(f"output {out} missing")
+        elif current != h: reasons.append(f"output {out} modified outside the pipeline")
+    return reasons
+
+def prepare_outputs(stage: dict, reasons: List[str]):
+    """Moves aside outputs the script would otherwise append to or resume from incorrectly."""
+    config_changed = any(r in ("script changed", "parameters changed") for r in reasons)
+    if stage["mode"] == "append" or (stage["mode"] == "resume" and config_changed):
+        for out in stage["outputs"]:
+            path = os.path.join(PIPELINE_DIR, out)
+            if os.path.exists(path):
+                shutil.move(path, path + ".prev")
+                print(f"[*] {stage['name']}: moved stale {out} -> {out}.prev")
+
+def stage_env(name: str) -> dict:
+    """
+    The runner's own exporter holds BIOSEARCH_METRICS_PORT, so each stage gets the port
+    METRICS_PORT + 1 + its index in STAGES (stages can run concurrently).
+    """
+    env = dict(os.environ)
+    if METRICS_PORT:
+        env["BIOSEARCH_METRICS_PORT"] = str(METRICS_PORT + 1 + list(STAGES).index(name))
+    return env
+
+def run_stage(stage: dict, log_to_file: bool, extra_args: Optional[List[str]] = None) -> int:
+    cmd = [sys.executable, stage["script"]] + (extra_args or [])
+    env = stage_env(stage["name"])
+    with span("stage", target=stage["name"]):
+        if not log_to_file:
+            code = subprocess.run(cmd, cwd=PIPELINE_DIR, env=env).returncode
+        else:
+            os.makedirs(os.path.join(PIPELINE_DIR, LOG_DIR), exist_ok=True)
+            log_path = os.path.join(PIPELINE_DIR, LOG_DIR, f"{stage['name']}.log")
+            with open(log_path, "w") as log:
+                code = subprocess.run(cmd, cwd=PIPELINE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    inc("stages_total", target=stage["name"], result="ok" if code == 0 else "failed")
+    return code
+
+def run_pipeline(targets: Optional[List[str]] = None, force: Optional[List[str]] = None,
+                 dry_run: bool = False, jobs: int = MAX_WORKERS, delta: bool = False):
+    resolved = {name: resolve_stage(name) for name in STAGES}
+    validate_dag(resolved)
+    order = topological_order(resolved)
+
+    # Restrict to the requested targets and everything they depend on
+    if targets:
+        wanted = set()
+        def collect(name):
+            if name in wanted: return
+            wanted.add(name)
+            for dep in resolved[name]["deps"]: collect(dep)
+        for t in targets: collect(t)
+        order = [n for n in order if n in wanted]
+
+    state = load_state()
+    hashes = HashCache(state.get("hash_cache"))
+    force = set(force or [])
+
+    if dry_run:
+        print("[*] Dry run: what would rebuild")
+        rebuilding = set()
+        for name in order:
+            stage = resolved[name]
+            parts = fingerprint_stage(stage, hashes)
+            reasons = stale_reasons(stage, parts, state["stages"].get(name), hashes)
+            if name in force and not (reasons and reasons[0].startswith("missing input")): reasons.insert(0, "forced")
+            if delta and stage["delta_args"] and not reasons: reasons.append("delta refresh")
+            upstream = [d for d in stage["deps"] if d in rebuilding]
+            if reasons and not reasons[0].startswith("missing input"):
+                rebuilding.add(name)
+                print(f"   [REBUILD] {name}: {'; '.join(reasons)}")
+            elif upstream:
+                rebuilding.add(name)
+                print(f"   [MAYBE]   {name}: upstream {', '.join(upstream)} rebuilds")
+            elif reasons:
+                print(f"   [BLOCKED] {name}: {'; '.join(reasons)}")
+            else:
+                print(f"   [OK]      {name}: up to date")
+        return True
+
+    print(f"[*] Running pipeline ({len(order)} stages, {jobs} worker(s))...")
+    status = {}   # name -> "built" | "skipped" | "failed" | "blocked"
+    pending = list(order)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                stage = resolved[name]
+                dep_status = [status.get(d) for d in stage["deps"] if d in order]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    status[name] = "blocked"
+                    pending.remove(name)
+                    print(f"[!] {name}: blocked by failed upstream stage")
+                    continue
+                if any(s is None for s in dep_status): continue
+
+                pending.remove(name)
+                parts = fingerprint_stage(stage, hashes)
+                reasons = stale_reasons(stage, parts, state["stages"].get(name), hashes)
+                if reasons and reasons[0].startswith("missing input"):
+                    status[name] = "blocked"
+                    print(f"[!] {name}: {reasons[0]}")
+                    continue
+                if name in force: reasons.insert(0, "forced")
+                incremental = delta and bool(stage["delta_args"]) and state["stages"].get(name) is not None
+                if incremental and not reasons: reasons.append("delta refresh")
+                if not reasons:
+                    status[name] = "skipped"
+                    print(f"[*] {name}: up to date")
+                    continue
+
+                print(f"[*] {name}: rebuilding ({'; '.join(reasons)})")
+                if incremental:
+                    future = pool.submit(run_stage, stage, jobs > 1, stage["delta_args"])
+                else:
+                    prepare_outputs(stage, reasons)
+                    future = pool.submit(run_stage, stage, jobs > 1)
+                running[future] = (name, parts, time.time())
+
+            if not running: continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, parts, started = running.pop(future)
+                stage = resolved[name]
+                elapsed = time.time() - started
+                try:
+                    code = future.result()
+                except Exception as e:
+                    print(f"[!] {name}: {e}")
+                    code = -1
+
+                missing = [o for o in stage["outputs"] if not os.path.exists(os.path.join(PIPELINE_DIR, o))]
+                if code != 0 or missing:
+                    status[name] = "failed"
+                    detail = f"exit code {code}" if code != 0 else f"no output {', '.join(missing)}"
+                    print(f"[!] {name}: FAILED ({detail}) after {elapsed:.1f}s")
+                    continue
+
+                status[name] = "built"
+                state["stages"][name] = {
+                    **parts,
+                    "outputs": {o: hashes.file_hash(os.path.join(PIPELINE_DIR, o)) for o in stage["outputs"]},
+                    "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "seconds": round(elapsed, 1),
+                }
+                state["hash_cache"] = hashes.entries
+                save_state(state)
+                print(f"[*] {name}: built in {elapsed:.1f}s")
+
+    state["hash_cache"] = hashes.entries
+    save_state(state)
+
+    print("\n==============================================")
+    for name in order:
+        print(f"  {name:<6} {status.get(name, 'blocked').upper()}")
+    print("==============================================")
+    return all(status.get(n) in ("built", "skipped") for n in order)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental runner for the BioSearch pre-processing steps.")
+    parser.add_argument("targets", nargs="*", help=f"Stages to bring up to date (default: all of {', '.join(STAGES)})")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would rebuild and why")
+    parser.add_argument("--force", nargs="+", default=[], choices=list(STAGES), help="Rebuild these stages regardless of fingerprints")
+    parser.add_argument("--delta", action="store_true", help="Incrementally refresh stages that support it (step2) and propagate only the changes")
+    parser.add_argument("--jobs", type=int, default=MAX_WORKERS, help="Independent stages to run concurrently")
+    parser.add_argument("--profile", metavar="DIR", help="Run every stage under the sampling profiler; folded stacks go to DIR")
+    args = parser.parse_args()
+    unknown = [t for t in args.targets if t not in STAGES]
+    if unknown: parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    # Stages run with cwd=Intermediates/; pin instrumentation paths to where the runner was started
+    if args.profile: os.environ["BIOSEARCH_PROFILE"] = args.profile
+    for var in ("BIOSEARCH_PROFILE", "BIOSEARCH_LOG_JSON", "BIOSEARCH_METRICS_FILE"):
+        if os.environ.get(var) and os.environ[var] != "-":
+            os.environ[var] = os.path.abspath(os.environ[var])
+    init("pipeline")
+
+    ok = run_pipeline(args.targets, force=args.force, dry_run=args.dry_run, jobs=max(1, args.jobs), delta=args.delta)
+    sys.exit(0 if ok else 1)
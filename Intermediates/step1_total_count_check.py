@@ -1,11 +1,27 @@
 import requests
+import argparse
+import datetime
+import hashlib
 import json
+import math
+import os
 import sys
+import time
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
-LENS_API_KEY = ""
-API_URL = "https://api.lens.org/patent/search"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import init, inc, span, record_http
+
+LENS_API_KEY = os.environ.get("LENS_API_KEY", "")
+API_URL = os.environ.get("LENS_API_URL", "https://api.lens.org/patent/search")
+WATERMARK_FILE = "Step2_Watermark.json"
+FACET_CACHE_FILE = "Step1_Facet_Cache.json"
+SHARD_PLAN_FILE = "Step1_Shard_Plan.json"
+CACHE_TTL_HOURS = 24
+NUM_SHARDS = 8
+RATE_LIMIT_PER_MIN = 50      # Lens API requests/minute allowed for the key
+FETCH_BATCH_SIZE = 100       # step2 BATCH_SIZE: patents per scroll request
 
 BIO_IPC_PATTERNS = ["C12*", "C07K*", "A61K*", "A01H*", "C12Q*", "C07H*", "A23L*"]
 
@@ -20,34 +36,47 @@ CUSTOM_IDA_KEYS = [
     "CCOS", "NBIMCC"
 ]
 DEPOSIT_KEYWORDS = ["Budapest Treaty", "International Depository Authority", "biological deposit", "culture collection"] + CUSTOM_IDA_KEYS
+EXPIRED_STATUSES = ["EXPIRED", "LAPSED", "REVOKED", "CEASED"]
+# Must match step2's DELTA_DATE_FIELDS so the delta count equals what step2 --delta fetches
+DELTA_DATE_FIELDS = ["date_published", "legal_status.anticipated_term_date", "legal_status.discontinuation_date"]
 
 def get_lens_session():
     session = requests.Session()
-    retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-    session.mount("https://", HTTPAdapter(max_retries=retry))
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["POST", "GET"])
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     return session
 
-def get_bio_patent_count():
-    EXPIRED_STATUSES = ["EXPIRED", "LAPSED", "REVOKED", "CEASED"]
+def build_must(since: str = None, until: str = None) -> list:
+    must = [
+        {"bool": {
+            "should": [{"wildcard": {"class_ipc.symbol": code}} for code in BIO_IPC_PATTERNS],
+            "minimum_should_match": 1
+        }},
+        
+        {"bool": {
+            "should": [{"match_phrase": {"full_text": kw}} for kw in DEPOSIT_KEYWORDS], 
+            "minimum_should_match": 1
+        }}
+    ]
+    if since:
+        # Same scope as step2 --delta: any status, changed between the watermark and today.
+        # The upper bound matters for anticipated_term_date, which lies in the future for every active patent.
+        until = until or datetime.datetime.utcnow().strftime("%Y-%m-%d")
+        must.append({"bool": {
+            "should": [{"range": {field: {"gte": since, "lte": until}}} for field in DELTA_DATE_FIELDS],
+            "minimum_should_match": 1
+        }})
+    else:
+        must.insert(0, {"terms": {"legal_status.patent_status": EXPIRED_STATUSES}})
+    return must
+
+def get_bio_patent_count(since: str = None):
+    must = build_must(since)
     
     query_payload = {
-        "query": {
-            "bool": {
-                "must": [
-                    {"terms": {"legal_status.patent_status": EXPIRED_STATUSES}},
-                
-                    {"bool": {
-                        "should": [{"wildcard": {"class_ipc.symbol": code}} for code in BIO_IPC_PATTERNS],
-                        "minimum_should_match": 1
-                    }},
-                    
-                    {"bool": {
-                        "should": [{"match_phrase": {"full_text": kw}} for kw in DEPOSIT_KEYWORDS], 
-                        "minimum_should_match": 1
-                    }}
-                ]
-            }
-        },
+        "query": {"bool": {"must": must}},
         "size": 0,
         "include": ["total"]
     }
@@ -60,7 +89,9 @@ def get_bio_patent_count():
     
     try:
         session = get_lens_session()
-        response = session.post(API_URL, json=query_payload, headers=headers, timeout=30)
+        with span("http.post", endpoint="count"):
+            response = session.post(API_URL, json=query_payload, headers=headers, timeout=30)
+        record_http(response, "count")
         
         if response.status_code != 200:
             print(f"[!] API Error: {response.status_code} - {response.text}")
@@ -78,7 +109,199 @@ def get_bio_patent_count():
         print(f"[ERROR] {e}")
         return 0
 
+def read_watermark():
+    if not os.path.exists(WATERMARK_FILE): return None
+    with open(WATERMARK_FILE, "r") as f:
+        return json.load(f).get("last_crawl_date")
+
+class FacetClient:
+    """
+    size=0 Lens queries behind a local JSON cache (FACET_CACHE_FILE) and a
+    client-side throttle, so re-planning is free and never trips the rate limit.
+    """
+    def __init__(self, refresh: bool = False):
+        self.session = get_lens_session()
+        self.headers = {"Authorization": f"Bearer {LENS_API_KEY}", "Content-Type": "application/json"}
+        self.refresh = refresh
+        self.cache = {}
+        self.api_calls = 0
+        self.last_call = 0.0
+        if os.path.exists(FACET_CACHE_FILE):
+            try:
+                with open(FACET_CACHE_FILE, "r") as f:
+                    self.cache = json.load(f)
+            except (OSError, ValueError):
+                print(f"[!] Warning: {FACET_CACHE_FILE} unreadable. Starting with an empty cache.")
+
+    def save(self):
+        tmp_file = FACET_CACHE_FILE + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_file, FACET_CACHE_FILE)
+
+    def query(self, must: list, aggregations: dict = None) -> dict:
+        payload = {"query": {"bool": {"must": must}}, "size": 0}
+        if aggregations: payload["aggregations"] = aggregations
+        key = hashlib.sha1(json.dumps([API_URL, payload], sort_keys=True).encode()).hexdigest()
+
+        cached = self.cache.get(key)
+        if cached and not self.refresh and time.time() - cached["fetched_at"] < CACHE_TTL_HOURS * 3600:
+            inc("facet_cache_total", result="hit")
+            return cached["data"]
+        inc("facet_cache_total", result="miss")
+
+        wait_s = 60.0 / RATE_LIMIT_PER_MIN - (time.time() - self.last_call)
+        if wait_s > 0: time.sleep(wait_s)
+        self.last_call = time.time()
+        self.api_calls += 1
+
+        with span("http.post", endpoint="facet"):
+            response = self.session.post(API_URL, json=payload, headers=self.headers, timeout=60)
+        record_http(response, "facet")
+        if response.status_code != 200:
+            raise RuntimeError(f"API Error: {response.status_code} - {response.text[:200]}")
+        data = response.json()
+        self.cache[key] = {"fetched_at": time.time(), "data": data}
+        return data
+
+    def count(self, must: list) -> int:
+        data = self.query(must)
+        if 'total' in data: return data['total']
+        return data.get('data', {}).get('total', 0) if isinstance(data.get('data'), dict) else 0
+
+    def histogram(self, must: list, interval: str) -> list:
+        """[(bucket_start 'YYYY-MM-DD', doc_count)] on date_published."""
+        aggs = {"by_date": {"date_histogram": {"field": "date_published", "interval": interval}}}
+        data = self.query(must, aggs)
+        buckets = data.get("aggregations", {}).get("by_date", {}).get("buckets", [])
+        result = []
+        for b in buckets:
+            start = b.get("key_as_string") or time.strftime("%Y-%m-%d", time.gmtime(b["key"] / 1000))
+            if b.get("doc_count", 0) > 0: result.append((start[:10], b["doc_count"]))
+        return result
+
+def collect_facets(client: FacetClient) -> dict:
+    """Counts per IPC pattern, per deposit keyword and per publication year."""
+    must = build_must()
+    # build_must(): [status, ipc-any, keyword-any] - swap single clauses in for the facets
+    ipc_pos, kw_pos = 1, 2
+
+    facets = {"total": client.count(must), "ipc": {}, "keyword": {}, "year": {}}
+    print(f"[*] Total in scope: {facets['total']:,}")
+
+    for code in BIO_IPC_PATTERNS:
+        facet_must = list(must)
+        facet_must[ipc_pos] = {"wildcard": {"class_ipc.symbol": code}}
+        facets["ipc"][code] = client.count(facet_must)
+        print(f"    - IPC {code:<6} {facets['ipc'][code]:>10,}", end='\r')
+
+    for i, kw in enumerate(DEPOSIT_KEYWORDS):
+        facet_must = list(must)
+        facet_must[kw_pos] = {"match_phrase": {"full_text": kw}}
+        facets["keyword"][kw] = client.count(facet_must)
+        print(f"    - Keyword {i+1}/{len(DEPOSIT_KEYWORDS)}: {kw:<40}", end='\r')
+    print()
+
+    for start, n in client.histogram(must, "year"):
+        facets["year"][start[:4]] = n
+    return facets
+
+def build_shard_plan(client: FacetClient, facets: dict, num_shards: int) -> dict:
+    """
+    Cuts the publication timeline into ~num_shards contiguous date ranges of roughly
+    equal size. Years bigger than one shard are re-bucketed by month first.
+    """
+    must = build_must()
+    target = max(1, math.ceil(sum(facets["year"].values()) / num_shards))
+
+    buckets = []   # (start 'YYYY-MM-DD', count), chronological
+    for year in sorted(facets["year"]):
+        n = facets["year"][year]
+        if n > target:
+            year_must = must + [{"range": {"date_published": {"gte": f"{year}-01-01", "lt": f"{int(year) + 1}-01-01"}}}]
+            buckets.extend(client.histogram(year_must, "month"))
+            continue
+        buckets.append((f"{year}-01-01", n))
+
+    shards, current = [], None
+    for start, n in buckets:
+        if current is None: current = {"date_from": start, "date_to": None, "estimated_patents": 0}
+        current["estimated_patents"] += n
+        if current["estimated_patents"] >= target:
+            shards.append(current)
+            current = None
+    if current: shards.append(current)
+
+    # Ranges are [date_from, date_to): each shard ends where the next begins, and the
+    # outer shards are left open so no publication date falls between shards
+    for prev, nxt in zip(shards, shards[1:]):
+        prev["date_to"] = nxt["date_from"]
+    if shards: shards[0]["date_from"] = None
+
+    # Patents without a publication date would fall through every range shard
+    undated = facets["total"] - sum(facets["year"].values())
+    if undated > 0:
+        shards.append({"date_from": None, "date_to": None, "missing_date": True, "estimated_patents": undated})
+
+    total_requests = 0
+    for i, sh in enumerate(shards):
+        sh["shard"] = i
+        sh["estimated_requests"] = max(1, math.ceil(sh["estimated_patents"] / FETCH_BATCH_SIZE))
+        sh["estimated_minutes"] = round(sh["estimated_requests"] / RATE_LIMIT_PER_MIN, 1)
+        total_requests += sh["estimated_requests"]
+
+    return {
+        "created": time.strftime("%Y-%m-%d"),
+        "target_patents_per_shard": target,
+        "rate_limit_per_min": RATE_LIMIT_PER_MIN,
+        "fetch_batch_size": FETCH_BATCH_SIZE,
+        "total_patents": facets["total"],
+        "total_requests": total_requests,
+        # All shards share one API key, so the rate limit bounds the whole crawl
+        "estimated_minutes": round(total_requests / RATE_LIMIT_PER_MIN, 1),
+        "facets": facets,
+        "shards": shards,
+    }
+
+def run_planner(num_shards: int, refresh: bool = False):
+    client = FacetClient(refresh=refresh)
+    print(f"[*] Planning full crawl into {num_shards} shards...")
+    try:
+        facets = collect_facets(client)
+        plan = build_shard_plan(client, facets, num_shards)
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        return None
+    finally:
+        client.save()
+
+    with open(SHARD_PLAN_FILE, "w") as f:
+        json.dump(plan, f, indent=2)
+
+    print("\n========================================================")
+    print(f"Crawl Plan: {plan['total_patents']:,} patents in {len(plan['shards'])} shards  (API calls: {client.api_calls}, rest cached)")
+    print("========================================================")
+    print("Top IPC patterns:   " + ", ".join(f"{k}={v:,}" for k, v in sorted(facets["ipc"].items(), key=lambda x: -x[1])[:5]))
+    print("Top keywords:       " + ", ".join(f"{k}={v:,}" for k, v in sorted(facets["keyword"].items(), key=lambda x: -x[1])[:5]))
+    for sh in plan["shards"]:
+        date_range = "no date" if sh.get("missing_date") else f"{sh['date_from'] or '...'} -> {sh['date_to'] or '...'}"
+        print(f"  Shard {sh['shard']:>2}: {date_range:<28} {sh['estimated_patents']:>9,} patents  ~{sh['estimated_minutes']} min")
+    print(f"Estimated crawl: {plan['total_requests']:,} requests = {plan['estimated_minutes']} min at {RATE_LIMIT_PER_MIN} req/min")
+    print(f"Plan saved to: {SHARD_PLAN_FILE}  (run: step2 --shard N)")
+    return plan
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count (and optionally plan) the Lens crawl.")
+    parser.add_argument("--plan", action="store_true", help=f"Collect facet counts and write a balanced shard plan to {SHARD_PLAN_FILE}")
+    parser.add_argument("--shards", type=int, default=NUM_SHARDS, help="Number of shards for --plan")
+    parser.add_argument("--refresh", action="store_true", help=f"Ignore {FACET_CACHE_FILE} and re-query")
+    args = parser.parse_args()
+    init("step1")
+
+    if args.plan:
+        run_planner(max(1, args.shards), refresh=args.refresh)
+        sys.exit(0)
+
     count = get_bio_patent_count()
     
     if count > 0:
@@ -88,3 +311,8 @@ if __name__ == "__main__":
         print(f"Criteria: Expired + Extended Bio-IPC + Deposit Keywords")
     else:
         print("\n[RESULT] No matching patents found.")
+
+    since = read_watermark()
+    if since:
+        delta_count = get_bio_patent_count(since=since)
+        print(f"Changed since last crawl ({since}): {delta_count:,}  -> step2 --delta")
@@ -1,3 +1,5 @@
+import argparse
+import hashlib
 import requests
 import json
 import pandas as pd
@@ -10,11 +12,24 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from typing import List, Dict, Tuple, Generator
 
-LENS_API_KEY = ""
-API_URL = "https://api.lens.org/patent/search"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import init, inc, span, record_http
+
+LENS_API_KEY = os.environ.get("LENS_API_KEY", "")
+# Point at mock_lens_server.py for offline runs: LENS_API_URL=http://127.0.0.1:8800/patent/search
+API_URL = os.environ.get("LENS_API_URL", "https://api.lens.org/patent/search")
 OUTPUT_FILE = "Step2_Output.csv"
+WATERMARK_FILE = "Step2_Watermark.json"
+SHARD_PLAN_FILE = "Step1_Shard_Plan.json"
+SHARD_OUTPUT_TEMPLATE = "Step2_Output.shard{}.csv"
 BATCH_SIZE = 100
 
+EXPIRED_STATUSES = ["EXPIRED", "LAPSED", "REVOKED", "CEASED"]
+# Date fields checked against the watermark in --delta mode: new publications,
+# patents reaching term, and patents discontinued (lapsed/revoked) since the last crawl.
+DELTA_DATE_FIELDS = ["date_published", "legal_status.anticipated_term_date", "legal_status.discontinuation_date"]
+OUTPUT_COLUMNS = ["Lens_ID", "Title", "Repository", "Accession_ID", "LIBERATED_STATUS", "Found_In_Claims", "Patent_Status", "Updated_At"]
+
 CUSTOM_IDA_PATTERNS = {
     "ATCC": [
         r"ATCC\s+(?:Accession\s+)?(?:No\.?|Number)?\s*[:]?\s*(PTA-[\d]+)",
@@ -53,36 +68,67 @@ ALL_PATTERNS = compile_regex_patterns()
 
 def get_lens_session():
     session = requests.Session()
-    retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-    session.mount("https://", HTTPAdapter(max_retries=retry))
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["POST", "GET"])
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     return session
 
-def fetch_gold_patents() -> Generator[List[dict], None, None]:
+def build_gold_query(since: str = None, shard: dict = None, until: str = None) -> dict:
+    """
+    Full mode: every expired bio-IPC patent with a deposit keyword.
+    Delta mode (since=YYYY-MM-DD): any status, but only patents whose publication or
+    legal status changed between the watermark and until (default: today), so
+    reinstatements are seen too.
+    shard: one entry of step1's shard plan, restricting date_published to [date_from, date_to).
+    """
     BIO_IPC_PATTERNS = ["C12*", "C07K*", "A61K*", "A01H*", "C12Q*", "C07H*", "A23L*"]
     
     DEPOSIT_KEYWORDS = ["Budapest Treaty", "International Depository Authority", "biological deposit", "culture collection"] + \
                        list(CUSTOM_IDA_PATTERNS.keys()) + STANDARD_IDA_ACRONYMS
 
-    query_payload = {
-        "query": {
-            "bool": {
-                "must": [
-                    {"terms": {"legal_status.patent_status": ["EXPIRED", "LAPSED", "REVOKED", "CEASED"]}},
-                    {"bool": {
-                        "should": [{"wildcard": {"class_ipc.symbol": code}} for code in BIO_IPC_PATTERNS],
-                        "minimum_should_match": 1
-                    }},
-                    {"bool": {
-                        "should": [{"match_phrase": {"full_text": kw}} for kw in DEPOSIT_KEYWORDS], 
-                        "minimum_should_match": 1
-                    }}
-                ]
-            }
-        },
+    must = [
+        {"bool": {
+            "should": [{"wildcard": {"class_ipc.symbol": code}} for code in BIO_IPC_PATTERNS],
+            "minimum_should_match": 1
+        }},
+        {"bool": {
+            "should": [{"match_phrase": {"full_text": kw}} for kw in DEPOSIT_KEYWORDS], 
+            "minimum_should_match": 1
+        }}
+    ]
+    if since:
+        # Bounded above: anticipated_term_date lies in the future for every active patent
+        until = until or datetime.datetime.utcnow().strftime("%Y-%m-%d")
+        must.append({"bool": {
+            "should": [{"range": {field: {"gte": since, "lte": until}}} for field in DELTA_DATE_FIELDS],
+            "minimum_should_match": 1
+        }})
+    else:
+        must.insert(0, {"terms": {"legal_status.patent_status": EXPIRED_STATUSES}})
+
+    query = {"bool": {"must": must}}
+    if shard and shard.get("missing_date"):
+        query["bool"]["must_not"] = [{"exists": {"field": "date_published"}}]
+    elif shard:
+        date_range = {}
+        if shard.get("date_from"): date_range["gte"] = shard["date_from"]
+        if shard.get("date_to"): date_range["lt"] = shard["date_to"]
+        if date_range: must.append({"range": {"date_published": date_range}})
+
+    return {
+        "query": query,
         "size": BATCH_SIZE,
         "scroll": "2m", 
         "include": ["lens_id", "biblio", "claims", "description", "legal_status"]
     }
+
+def fetch_gold_patents(since: str = None, progress: dict = None, shard: dict = None,
+                       until: str = None) -> Generator[List[dict], None, None]:
+    """Scrolls through the query. Sets progress['complete'] only if the scroll was exhausted."""
+    query_payload = build_gold_query(since, shard, until)
+    if progress is None: progress = {}
+    progress["complete"] = False
     
     headers = {"Authorization": f"Bearer {LENS_API_KEY}", "Content-Type": "application/json"}
     session = get_lens_session()
@@ -90,7 +136,9 @@ def fetch_gold_patents() -> Generator[List[dict], None, None]:
     print(f"[*] Initializing Extended Gold Standard Mining...")
     
     try:
-        response = session.post(API_URL, json=query_payload, headers=headers, timeout=60)
+        with span("http.post", endpoint="search"):
+            response = session.post(API_URL, json=query_payload, headers=headers, timeout=60)
+        record_http(response, "search")
         if response.status_code != 200:
             print(f"[!] Init Failed: {response.text}")
             return
@@ -101,20 +149,27 @@ def fetch_gold_patents() -> Generator[List[dict], None, None]:
         
         if not patents:
             print("[*] No patents found.")
+            progress["complete"] = True
             return
             
+        inc("patents_fetched_total", len(patents))
         yield patents
         
         total_fetched = len(patents)
         print(f" -> Batch 1 done. Total: {total_fetched}", end='\r')
 
         while True:
-            if not scroll_id: break
+            if not scroll_id:
+                progress["complete"] = True
+                break
             
             try:
-                resp = session.post(API_URL, json={"scroll_id": scroll_id, "scroll": "2m"}, headers=headers, timeout=60)
+                with span("http.post", endpoint="scroll"):
+                    resp = session.post(API_URL, json={"scroll_id": scroll_id, "scroll": "2m"}, headers=headers, timeout=60)
+                record_http(resp, "scroll")
                 if resp.status_code != 200:
                     if resp.status_code >= 500: 
+                        inc("scroll_retries_total")
                         time.sleep(5)
                         continue
                     break
@@ -123,8 +178,11 @@ def fetch_gold_patents() -> Generator[List[dict], None, None]:
                 patents = data.get("data", [])
                 scroll_id = data.get("scroll_id")
                 
-                if not patents: break
+                if not patents:
+                    progress["complete"] = True
+                    break
                 
+                inc("patents_fetched_total", len(patents))
                 yield patents
                 
                 total_fetched += len(patents)
@@ -172,10 +230,11 @@ def is_liberated(claims_text: str, acc_id: str) -> bool:
     def normalize(s): return re.sub(r'[^A-Z0-9\.\-]', '', s.upper())
     return normalize(acc_id) in normalize(claims_text)
 
-def process_batch(patents: List[dict]) -> List[dict]:
+def process_batch(patents: List[dict], updated_at: str = "") -> List[dict]:
     results = []
     for patent in patents:
         lens_id = patent.get("lens_id")
+        patent_status = (patent.get("legal_status") or {}).get("patent_status", "")
         title = patent.get("biblio", {}).get("invention_title", [{}])[0].get("text", "No Title")
         claims_text = get_claims_text_robust(patent.get("claims", []))
         desc_text = patent.get("description", {}).get("text", "") 
@@ -192,37 +251,277 @@ def process_batch(patents: List[dict]) -> List[dict]:
                 "Repository": repo,
                 "Accession_ID": acc_id,
                 "LIBERATED_STATUS": "OPEN SOURCE" if in_claims else "Mentioned",
-                "Found_In_Claims": in_claims
+                "Found_In_Claims": in_claims,
+                "Patent_Status": patent_status,
+                "Updated_At": updated_at
             })
     return results
 
-if __name__ == "__main__":
+def read_watermark() -> str:
+    if not os.path.exists(WATERMARK_FILE): return None
+    with open(WATERMARK_FILE, "r") as f:
+        return json.load(f).get("last_crawl_date")
+
+def write_watermark(crawl_date: str, mode: str):
+    tmp_file = WATERMARK_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"last_crawl_date": crawl_date, "mode": mode, "written_at": datetime.datetime.utcnow().isoformat()}, f, indent=2)
+    os.replace(tmp_file, WATERMARK_FILE)
+
+def ensure_output_schema(output_file: str = OUTPUT_FILE):
+    """Creates the output file, or upgrades one written before Patent_Status/Updated_At existed."""
+    if not os.path.exists(output_file):
+        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(output_file, index=False)
+        print(f"[*] Created output file: {output_file}")
+        return
+
+    header = list(pd.read_csv(output_file, nrows=0).columns)
+    if header != OUTPUT_COLUMNS:
+        df = pd.read_csv(output_file, dtype=str, keep_default_na=False)
+        df.reindex(columns=OUTPUT_COLUMNS, fill_value="").to_csv(output_file, index=False)
+        print(f"[*] Upgraded {output_file} to columns {OUTPUT_COLUMNS}")
+
+def previous_versions(df_new: pd.DataFrame, df_old: pd.DataFrame) -> pd.Series:
+    """
+    Per row of df_new (same order): the Updated_At its (Lens_ID, Accession_ID) had in df_old
+    if none of its content columns changed, else NaN.
+    """
+    content_cols = [c for c in OUTPUT_COLUMNS if c != "Updated_At"]
+    old = df_old.reindex(columns=OUTPUT_COLUMNS, fill_value="").astype(str)
+    old = old.drop_duplicates(subset=["Lens_ID", "Accession_ID"], keep="last")
+    # Content columns include the key, so each new row matches at most one old row
+    return df_new[content_cols].astype(str).merge(old, on=content_cols, how="left")["Updated_At"]
+
+def read_previous_output() -> pd.DataFrame:
+    """Rows from before this crawl: OUTPUT_FILE.prev (moved aside by run_pipeline), then OUTPUT_FILE."""
+    frames = [pd.read_csv(f, dtype=str, keep_default_na=False) for f in (OUTPUT_FILE + ".prev", OUTPUT_FILE) if os.path.exists(f)]
+    if not frames: return pd.DataFrame(columns=OUTPUT_COLUMNS)
+    return pd.concat(frames, ignore_index=True).reindex(columns=OUTPUT_COLUMNS, fill_value="")
+
+def keep_previous_versions(df: pd.DataFrame, df_prev: pd.DataFrame) -> pd.DataFrame:
+    """
+    A full crawl or shard merge re-stamps every row; unchanged rows get their previous
+    Updated_At back, so steps 3-5 do not redo them.
+    """
+    if df_prev.empty: return df
+    versions = previous_versions(df, df_prev).to_numpy()
+    kept = pd.notna(versions)
+    df = df.copy()
+    df.loc[kept, "Updated_At"] = versions[kept]
+    print(f"[*] {int(kept.sum())} of {len(df)} deposits unchanged since the previous crawl keep their Updated_At")
+    return df
+
+def upsert_deposits(delta_rows: List[dict], status_by_lens: Dict[str, str]) -> Dict[str, int]:
+    """
+    Merges delta rows into OUTPUT_FILE keyed by (Lens_ID, Accession_ID).
+    Unchanged rows keep their old Updated_At so downstream steps do not redo them.
+    Known patents that are no longer expired are marked REINSTATED.
+    """
+    df_old = pd.read_csv(OUTPUT_FILE, dtype=str, keep_default_na=False)
+    df_new = pd.DataFrame(delta_rows, columns=OUTPUT_COLUMNS).astype(str)
+    key_cols = ["Lens_ID", "Accession_ID"]
+
+    unchanged = previous_versions(df_new, df_old).notna().to_numpy()
+    known = pd.MultiIndex.from_frame(df_new[key_cols]).isin(pd.MultiIndex.from_frame(df_old[key_cols]))
+    keep_new = df_new[~unchanged]
+    stats = {"new": int((~known).sum()), "updated": int((known & ~unchanged).sum()), "unchanged": int(unchanged.sum()),
+             "reinstated": 0, "revoked": int((keep_new["Patent_Status"] == "REVOKED").sum())}
+
+    df = pd.concat([df_old, keep_new], ignore_index=True)
+    df = df.drop_duplicates(subset=key_cols, keep="last")
+
+    reinstated = {lid for lid, status in status_by_lens.items() if status and status not in EXPIRED_STATUSES}
+    mask = df["Lens_ID"].isin(reinstated) & (df["LIBERATED_STATUS"] != "REINSTATED")
+    if mask.any():
+        df.loc[mask, "LIBERATED_STATUS"] = "REINSTATED"
+        df.loc[mask, "Patent_Status"] = df.loc[mask, "Lens_ID"].map(status_by_lens)
+        df.loc[mask, "Updated_At"] = delta_rows[0]["Updated_At"] if delta_rows else datetime.datetime.utcnow().isoformat()
+        stats["reinstated"] = int(mask.sum())
+
+    tmp_file = OUTPUT_FILE + ".tmp"
+    df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, OUTPUT_FILE)
+    return stats
+
+def plan_sha256() -> str:
+    """Identifies the current shard plan; .done markers from another plan do not count."""
+    with open(SHARD_PLAN_FILE, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_shard(shard_no: int) -> dict:
+    if not os.path.exists(SHARD_PLAN_FILE):
+        raise FileNotFoundError(f"{SHARD_PLAN_FILE} not found. Run: step1 --plan")
+    with open(SHARD_PLAN_FILE, "r") as f:
+        shards = json.load(f)["shards"]
+    if not 0 <= shard_no < len(shards):
+        raise ValueError(f"Shard {shard_no} not in plan (0..{len(shards) - 1})")
+    return shards[shard_no]
+
+def run_full_crawl(shard_no: int = None):
     start_time = time.time()
-    
-    if not os.path.exists(OUTPUT_FILE):
-        pd.DataFrame(columns=["Lens_ID", "Title", "Repository", "Accession_ID", "LIBERATED_STATUS", "Found_In_Claims"]).to_csv(OUTPUT_FILE, index=False)
-        print(f"[*] Created output file: {OUTPUT_FILE}")
-    else:
-        print(f"[*] Appending to: {OUTPUT_FILE}")
+    crawl_date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+    updated_at = datetime.datetime.utcnow().isoformat()
+
+    # Shards run as separate processes, so each writes its own file; --merge-shards combines them
+    shard = load_shard(shard_no) if shard_no is not None else None
+    output_file = SHARD_OUTPUT_TEMPLATE.format(shard_no) if shard else OUTPUT_FILE
+    if shard:
+        print(f"[*] Shard {shard_no}: date_published [{shard.get('date_from')}, {shard.get('date_to')}) ~{shard['estimated_patents']:,} patents")
+        # A shard always restarts from scratch: rows and markers from an earlier run or plan are stale
+        for stale in (output_file + ".done", output_file):
+            if os.path.exists(stale): os.remove(stale)
+    elif os.path.exists(output_file):
+        print(f"[*] Appending to: {output_file}")
+    # Shards are compared against the previous output when they are merged
+    df_prev = read_previous_output() if not shard else None
+    ensure_output_schema(output_file)
 
     total_extracted = 0
     liberated_count = 0
+    progress = {}
     
-    for patent_batch in fetch_gold_patents():
-        batch_results = process_batch(patent_batch)
+    for patent_batch in fetch_gold_patents(progress=progress, shard=shard):
+        with span("parse"):
+            batch_results = process_batch(patent_batch, updated_at)
         if batch_results:
-            df_batch = pd.DataFrame(batch_results)
-            df_batch.to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
+            df_batch = pd.DataFrame(batch_results, columns=OUTPUT_COLUMNS)
+            with span("io.write_csv"):
+                df_batch.to_csv(output_file, mode='a', header=False, index=False)
+            inc("rows_total", len(df_batch))
             total_extracted += len(df_batch)
             liberated_count += df_batch['Found_In_Claims'].sum()
             
             print(f"   + Extracted {len(df_batch)} deposits ({liberated_count} Liberated).", end='\r')
             sys.stdout.flush()
 
+    if df_prev is not None and total_extracted:
+        with span("io.keep_versions"):
+            df = pd.read_csv(output_file, dtype=str, keep_default_na=False)
+            df = keep_previous_versions(df.drop_duplicates(subset=["Lens_ID", "Accession_ID"], keep="last"), df_prev)
+            tmp_file = output_file + ".tmp"
+            df.to_csv(tmp_file, index=False)
+            os.replace(tmp_file, output_file)
+
+    if progress["complete"] and shard:
+        with open(output_file + ".done", "w") as f:
+            json.dump({"crawl_date": crawl_date, "shard": shard_no, "plan_sha256": plan_sha256(),
+                       "date_from": shard.get("date_from"), "date_to": shard.get("date_to")}, f)
+    elif progress["complete"]:
+        write_watermark(crawl_date, "full")
+
     print(f"\n\n==============================================")
     print(f"[COMPLETE] Gold Mining Finished.")
     print(f"Total Deposit Events: {total_extracted}")
     print(f"Total LIBERATED Assets: {liberated_count}")
+    print(f"Data saved to: {output_file}")
+    if not progress["complete"]:
+        print(f"[!] Crawl did not finish. Watermark NOT advanced.")
+    print(f"Time: {(time.time() - start_time)/60:.1f} mins")
+    print(f"==============================================")
+
+def merge_shards(allow_partial: bool = False):
+    """
+    Combines every shard file of the plan into OUTPUT_FILE and advances the watermark.
+    Refuses while a shard is missing, unfinished or finished under another plan, since the
+    merge replaces OUTPUT_FILE; allow_partial writes it anyway but leaves the watermark alone.
+    """
+    with open(SHARD_PLAN_FILE, "r") as f:
+        shards = json.load(f)["shards"]
+    current_plan = plan_sha256()
+
+    frames, crawl_dates, unfinished = [], [], []
+    for sh in shards:
+        shard_file = SHARD_OUTPUT_TEMPLATE.format(sh["shard"])
+        if not os.path.exists(shard_file):
+            unfinished.append(sh["shard"])
+            continue
+        frames.append(pd.read_csv(shard_file, dtype=str, keep_default_na=False))
+        done = {}
+        if os.path.exists(shard_file + ".done"):
+            with open(shard_file + ".done", "r") as f:
+                done = json.load(f)
+        if done.get("plan_sha256") == current_plan:
+            crawl_dates.append(done["crawl_date"])
+        else:
+            if done: print(f"[!] Shard {sh['shard']} finished under a different {SHARD_PLAN_FILE}. Re-run it.")
+            unfinished.append(sh["shard"])
+
+    if not frames:
+        print("[!] No shard outputs found.")
+        return
+    if unfinished and not allow_partial:
+        print(f"[!] Shards not finished: {unfinished}. {OUTPUT_FILE} left untouched (use --allow-partial to merge anyway).")
+        return
+
+    df = pd.concat(frames, ignore_index=True).reindex(columns=OUTPUT_COLUMNS, fill_value="")
+    df = df.drop_duplicates(subset=["Lens_ID", "Accession_ID"], keep="last")
+    df = keep_previous_versions(df, read_previous_output())
+    tmp_file = OUTPUT_FILE + ".tmp"
+    df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, OUTPUT_FILE)
+    print(f"[*] Merged {len(frames)} shard files -> {OUTPUT_FILE} ({len(df)} deposits)")
+
+    if unfinished:
+        print(f"[!] Partial merge, shards not finished: {unfinished}. Watermark NOT advanced.")
+    else:
+        # The oldest shard start bounds what the crawl could have missed
+        write_watermark(min(crawl_dates), "full")
+
+def run_delta_crawl():
+    since = read_watermark()
+    if not since or not os.path.exists(OUTPUT_FILE):
+        print(f"[!] No previous crawl found ({WATERMARK_FILE} / {OUTPUT_FILE}). Run a full crawl first.")
+        return
+
+    start_time = time.time()
+    crawl_date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+    updated_at = datetime.datetime.utcnow().isoformat()
+    ensure_output_schema()
+    print(f"[*] Delta crawl: patents changed since {since}")
+
+    delta_rows = []
+    status_by_lens = {}
+    progress = {}
+    for patent_batch in fetch_gold_patents(since=since, progress=progress, until=crawl_date):
+        for patent in patent_batch:
+            status_by_lens[patent.get("lens_id")] = (patent.get("legal_status") or {}).get("patent_status", "")
+        # Deposits are only liberated while the patent is expired; active ones only feed REINSTATED marking
+        expired = [p for p in patent_batch if (p.get("legal_status") or {}).get("patent_status") in EXPIRED_STATUSES]
+        with span("parse"):
+            delta_rows.extend(process_batch(expired, updated_at))
+
+    if not progress["complete"]:
+        print(f"\n[!] Delta crawl did not finish. Nothing merged, watermark stays at {since}.")
+        return
+
+    with span("io.upsert"):
+        stats = upsert_deposits(delta_rows, status_by_lens)
+    inc("rows_total", len(delta_rows))
+    write_watermark(crawl_date, "delta")
+
+    print(f"\n\n==============================================")
+    print(f"[COMPLETE] Delta Ingestion Finished.")
+    print(f"Patents changed since {since}: {len(status_by_lens)}")
+    print(f"New Deposits:        {stats['new']}")
+    print(f"Updated Deposits:    {stats['updated']} ({stats['revoked']} revoked)")
+    print(f"Unchanged Deposits:  {stats['unchanged']}")
+    print(f"Reinstated (closed): {stats['reinstated']}")
     print(f"Data saved to: {OUTPUT_FILE}")
     print(f"Time: {(time.time() - start_time)/60:.1f} mins")
     print(f"==============================================")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mine deposit accession numbers from expired bio patents.")
+    parser.add_argument("--delta", action="store_true", help=f"Only fetch patents changed since the watermark in {WATERMARK_FILE} and upsert them")
+    parser.add_argument("--shard", type=int, help=f"Full crawl of one shard from {SHARD_PLAN_FILE} (see step1 --plan)")
+    parser.add_argument("--merge-shards", action="store_true", help=f"Combine finished shard outputs into {OUTPUT_FILE}")
+    parser.add_argument("--allow-partial", action="store_true", help="With --merge-shards: replace the output even if some shards are unfinished")
+    args = parser.parse_args()
+    init("step2")
+
+    if args.delta:
+        run_delta_crawl()
+    elif args.merge_shards:
+        merge_shards(args.allow_partial)
+    else:
+        run_full_crawl(args.shard)
@@ -7,16 +7,24 @@ import sys
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import init, inc, span, record_http
+from incremental import current_versions, prune_stale_output, row_keys
+
 INPUT_FILE = "Step2_Output.csv"
-OUTPUT_FILE = "step3_Output.csv"
-LENS_API_KEY = ""
-API_URL = "https://api.lens.org/patent/search"
+OUTPUT_FILE = "Step3_Output.csv"
+LENS_API_KEY = os.environ.get("LENS_API_KEY", "")
+API_URL = os.environ.get("LENS_API_URL", "https://api.lens.org/patent/search")
 BATCH_SIZE = 50 
 CONTEXT_WINDOW = 1000
+OUTPUT_COLUMNS = ["Accession_ID", "Repository", "Lens_ID", "Title", "Context_Snippet", "Updated_At"]
+
 def get_session():
     s = requests.Session()
     retries = Retry(total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["POST", "GET"])
-    s.mount("https://", HTTPAdapter(max_retries=retries))
+    adapter = HTTPAdapter(max_retries=retries)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
     return s
 
 def aggressive_context_extract(full_text, accession_id, window=1000):
@@ -59,6 +67,7 @@ def aggressive_context_extract(full_text, accession_id, window=1000):
             return ""
             
     return ""
+
 def fetch_snippets():
     print(f"[*] Loading input: {INPUT_FILE}...")
     if not os.path.exists(INPUT_FILE):
@@ -74,19 +83,22 @@ def fetch_snippets():
     
     print(f"[*] Total Liberated Assets to process: {len(df)}")
 
+    # Step2 stamps each row with Updated_At; a key is only "done" if it was processed at that version
+    versions = current_versions(df)
+    df['unique_key'] = row_keys(df)
+
     processed_keys = set()
     if os.path.exists(OUTPUT_FILE):
         try:
-            df_done = pd.read_csv(OUTPUT_FILE, on_bad_lines='skip')
-            processed_keys = set(df_done['Lens_ID'].astype(str) + "_" + df_done['Accession_ID'].astype(str))
+            df_done = pd.read_csv(OUTPUT_FILE, on_bad_lines='skip', dtype=str, keep_default_na=False)
+            processed_keys = prune_stale_output(df_done, versions, OUTPUT_FILE, OUTPUT_COLUMNS)
             print(f"[*] Resuming: {len(processed_keys)} assets already finished.")
         except:
             print("[!] Warning: Could not read existing output. Will append.")
     else:
-        pd.DataFrame(columns=["Accession_ID", "Repository", "Lens_ID", "Title", "Context_Snippet"]).to_csv(OUTPUT_FILE, index=False)
+        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(OUTPUT_FILE, index=False)
         print(f"[*] Created output file: {OUTPUT_FILE}")
 
-    df['unique_key'] = df['Lens_ID'].astype(str) + "_" + df['Accession_ID'].astype(str)
     df_todo = df[~df['unique_key'].isin(processed_keys)].copy()
     
     if df_todo.empty:
@@ -112,7 +124,9 @@ def fetch_snippets():
                 "include": ["lens_id", "description", "claims"]
             }
             
-            response = session.post(API_URL, json=payload, headers=headers, timeout=60)
+            with span("http.post", endpoint="search"):
+                response = session.post(API_URL, json=payload, headers=headers, timeout=60)
+            record_http(response, "search")
             
             if response.status_code != 200:
                 print(f"\n[!] API Error Batch {i}: {response.status_code}")
@@ -129,23 +143,26 @@ def fetch_snippets():
                 text_map[pat["lens_id"]] = desc + " " + claims_str
             
             relevant_rows = df_todo[df_todo['Lens_ID'].isin(batch_ids)]
-            for _, row in relevant_rows.iterrows():
-                lid = row['Lens_ID']
-                acc_id = row['Accession_ID']
-                full_text = text_map.get(lid, "")
+            with span("parse"):
+                for _, row in relevant_rows.iterrows():
+                    lid = row['Lens_ID']
+                    acc_id = row['Accession_ID']
+                    full_text = text_map.get(lid, "")
                 
-                snippet = aggressive_context_extract(full_text, acc_id, window=CONTEXT_WINDOW)
+                    snippet = aggressive_context_extract(full_text, acc_id, window=CONTEXT_WINDOW)
                 
-                batch_results.append({
-                    "Accession_ID": acc_id,
-                    "Repository": row['Repository'],
-                    "Lens_ID": lid,
-                    "Title": row['Title'],
-                    "Context_Snippet": snippet
-                })
+                    batch_results.append({
+                        "Accession_ID": acc_id,
+                        "Repository": row['Repository'],
+                        "Lens_ID": lid,
+                        "Title": row['Title'],
+                        "Context_Snippet": snippet,
+                        "Updated_At": row['Updated_At']
+                    })
             
             if batch_results:
-                pd.DataFrame(batch_results).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
+                pd.DataFrame(batch_results, columns=OUTPUT_COLUMNS).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
+                inc("rows_total", len(batch_results))
                 assets_saved_session += len(batch_results)
             
             print(f" -> Batch {i+1}/{len(patent_batches)} done. Saved {assets_saved_session} snippets.", end='\r')
@@ -159,4 +176,5 @@ def fetch_snippets():
     print(f"\n\n[SUCCESS] Run Complete. Snippets saved to {OUTPUT_FILE}")
 
 if __name__ == "__main__":
+    init("step3")
     fetch_snippets()
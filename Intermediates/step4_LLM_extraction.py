@@ -6,10 +6,19 @@ import os
 import sys
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import init, inc, span
+from incremental import current_versions, prune_stale_output
+
 INPUT_FILE = "Step3_Output.csv"
 OUTPUT_FILE = "Step4_Output.csv"
 MODEL_NAME = "llama3"
 BATCH_SIZE = 10 
+OUTPUT_COLUMNS = [
+    "Accession_ID", "Repository", "Lens_ID", "Title", 
+    "Bio_Name", "Bio_Strain", "Bio_Category", "Bio_Application", 
+    "LLM_Status", "Raw_Response", "Updated_At"
+]
 
 def extract_json_from_text(text):
     """
@@ -41,7 +50,8 @@ def run_extraction():
     print(f"[*] Connecting to Local LLM ({MODEL_NAME})...")
     try:
         llm = Ollama(model=MODEL_NAME, temperature=0, keep_alive="3h")
-        llm.invoke("Hi") 
+        with span("llm.invoke", attempt="warmup"):
+            llm.invoke("Hi")
         print("[*] Connection Successful.")
     except Exception as e:
         print(f"[!] Error: {e}")
@@ -54,22 +64,20 @@ def run_extraction():
     df_input = pd.read_csv(INPUT_FILE)
     print(f"[*] Loaded {len(df_input)} snippets.")
 
+    # Step3 carries step2's Updated_At; only rows extracted at the current version count as done
+    versions = current_versions(df_input)
+
     processed_keys = set()
     if os.path.exists(OUTPUT_FILE):
         try:
-            df_existing = pd.read_csv(OUTPUT_FILE, on_bad_lines='skip')
+            df_existing = pd.read_csv(OUTPUT_FILE, on_bad_lines='skip', dtype=str, keep_default_na=False)
             if 'Lens_ID' in df_existing.columns:
-                processed_keys = set(df_existing['Lens_ID'].astype(str) + "_" + df_existing['Accession_ID'].astype(str))
+                processed_keys = prune_stale_output(df_existing, versions, OUTPUT_FILE, OUTPUT_COLUMNS)
             print(f"[*] Resuming: {len(processed_keys)} assets done.")
         except:
             print("[!] Output file corrupted. Starting fresh.")
     else:
-        columns = [
-            "Accession_ID", "Repository", "Lens_ID", "Title", 
-            "Bio_Name", "Bio_Strain", "Bio_Category", "Bio_Application", 
-            "LLM_Status", "Raw_Response"
-        ]
-        pd.DataFrame(columns=columns).to_csv(OUTPUT_FILE, index=False)
+        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(OUTPUT_FILE, index=False)
 
     print(f"[*] Starting Refined Extraction...")
     
@@ -106,13 +114,16 @@ def run_extraction():
             raw_response = ""
             try:
                 # Attempt 1: Direct
-                raw_response = llm.invoke(prompt)
+                with span("llm.invoke", attempt="direct"):
+                    raw_response = llm.invoke(prompt)
                 json_str = extract_json_from_text(raw_response)
                 
                 if not json_str:
                     # Attempt 2: Self-Correction
+                    inc("llm_repairs_total")
                     repair_prompt = f"Extract the JSON object from this text:\n{raw_response}"
-                    json_str = extract_json_from_text(llm.invoke(repair_prompt))
+                    with span("llm.invoke", attempt="repair"):
+                        json_str = extract_json_from_text(llm.invoke(repair_prompt))
                 
                 if json_str:
                     data = json.loads(json_str)
@@ -136,17 +147,19 @@ def run_extraction():
                     "Raw_Response": raw_response.replace("\n", " ")[:500]
                 }
 
+        inc("rows_total", status=result["LLM_Status"])
         row_out = {
             "Accession_ID": row['Accession_ID'],
             "Repository": row['Repository'],
             "Lens_ID": row['Lens_ID'],
             "Title": row['Title'],
-            **result
+            **result,
+            "Updated_At": row['Updated_At']
         }
         batch_buffer.append(row_out)
         
         if len(batch_buffer) >= BATCH_SIZE:
-            pd.DataFrame(batch_buffer).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
+            pd.DataFrame(batch_buffer, columns=OUTPUT_COLUMNS).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
             status = result['Bio_Name'] if result['Bio_Name'] != "Unknown" else result['LLM_Status']
             print(f"\r\033[K -> Processed {len(processed_keys) + len(batch_buffer)}/{len(df_input)} | Last: {status}", end='')
             processed_keys.add(unique_key)
@@ -154,9 +167,10 @@ def run_extraction():
             sys.stdout.flush()
 
     if batch_buffer:
-        pd.DataFrame(batch_buffer).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
+        pd.DataFrame(batch_buffer, columns=OUTPUT_COLUMNS).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
         
     print(f"\n[SUCCESS] Extraction Complete. File: {OUTPUT_FILE}")
 
 if __name__ == "__main__":
+    init("step4")
     run_extraction()
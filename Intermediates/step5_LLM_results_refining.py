@@ -2,6 +2,11 @@ import pandas as pd
 import re
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import init, inc, span
+from incremental import current_versions, row_keys, still_current
 
 INPUT_FILE = "Step4_Output.csv"
 OUTPUT_FILE = "Step5_Output.csv"
@@ -67,22 +72,34 @@ def run_polish():
         print(f"[!] File not found: {INPUT_FILE}")
         return
 
-    df = pd.read_csv(INPUT_FILE)
-    print(f"[*] Polishing {len(df)} rows...")
+    with span("io.read_csv"):
+        df_input = pd.read_csv(INPUT_FILE)
+    versions = current_versions(df_input)
+
+    # Rows polished earlier at the same Updated_At are kept as they are; only new/changed ones are redone
+    df_kept = pd.DataFrame(columns=df_input.columns)
+    if os.path.exists(OUTPUT_FILE):
+        df_done = pd.read_csv(OUTPUT_FILE)
+        if {'Lens_ID', 'Accession_ID'} <= set(df_done.columns):
+            df_kept = df_done[still_current(df_done, versions)]
+            df_kept = df_kept[~row_keys(df_kept).duplicated(keep="last")]
+    df = df_input[~row_keys(df_input).isin(set(row_keys(df_kept)))].reset_index(drop=True)
+    print(f"[*] Polishing {len(df)} rows ({len(df_kept)} unchanged rows kept from {OUTPUT_FILE})...")
     
     # TRACKING METRICS
     stats = {"Rescued": 0, "Cleaned_Human": 0, "Cleaned_Hybridoma": 0, "Cleaned_Plasmid": 0}
     
     # 1. RESCUE FAILED JSON
-    for i, row in df.iterrows():
-        if "Failed" in str(row['LLM_Status']) or "Error" in str(row['LLM_Status']):
-            data = aggressive_rescue(row['Raw_Response'])
-            if data:
-                df.at[i, 'Bio_Name'] = data['Bio_Name']
-                df.at[i, 'Bio_Category'] = data['Bio_Category']
-                df.at[i, 'Bio_Application'] = data['Bio_Application']
-                df.at[i, 'LLM_Status'] = "Rescued"
-                stats["Rescued"] += 1
+    with span("parse", phase="rescue"):
+        for i, row in df.iterrows():
+            if "Failed" in str(row['LLM_Status']) or "Error" in str(row['LLM_Status']):
+                data = aggressive_rescue(row['Raw_Response'])
+                if data:
+                    df.at[i, 'Bio_Name'] = data['Bio_Name']
+                    df.at[i, 'Bio_Category'] = data['Bio_Category']
+                    df.at[i, 'Bio_Application'] = data['Bio_Application']
+                    df.at[i, 'LLM_Status'] = "Rescued"
+                    stats["Rescued"] += 1
 
     def tracked_clean(row):
         old_name = str(row['Bio_Name']).lower()
@@ -95,9 +112,19 @@ def run_polish():
         
         return new_row
 
-    df = df.apply(tracked_clean, axis=1)
-    
-    df.to_csv(OUTPUT_FILE, index=False)
+    with span("parse", phase="clean_generics"):
+        if len(df): df = df.apply(tracked_clean, axis=1)
+
+    # Kept and re-polished rows go back into input order
+    df = pd.concat([df_kept, df], ignore_index=True)
+    position = dict(zip(row_keys(df_input), range(len(df_input))))
+    df = df.iloc[row_keys(df).map(position).to_numpy().argsort(kind="stable")].reindex(columns=df_input.columns)
+
+    with span("io.write_csv"):
+        df.to_csv(OUTPUT_FILE + ".tmp", index=False)
+        os.replace(OUTPUT_FILE + ".tmp", OUTPUT_FILE)
+    inc("rows_total", len(df))
+    for name, n in stats.items(): inc("polish_fixes_total", n, kind=name)
     
     print("\n" + "="*40)
     print(f" [SUCCESS] POLISHING COMPLETE")
@@ -110,4 +137,5 @@ def run_polish():
     print(f" Final Dataset Saved to: {OUTPUT_FILE}")
 
 if __name__ == "__main__":
+    init("step5")
     run_polish()
@@ -3,67 +3,384 @@ import faiss
 import numpy as np
 import pickle
 import os
+import json
+import zlib
+import argparse
+import hashlib
+import shutil
+import sys
+import time
 from sentence_transformers import SentenceTransformer
-from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import init, inc, span
+# Shared with the app so the facet layout and the snapshot location/pointer have one definition
+from search_engine import build_facet_index, file_sha256, read_current_version, SNAPSHOT_DIR, CURRENT_POINTER
 
 INPUT_FILE = "Step5_Output.csv"
 INDEX_FILE = "bio_faiss.index"   # The Search Engine
 META_FILE = "bio_meta.pkl"       # The Data Lookup
+SUMMARY_FILE = "bio_summary.json" # Facet counts + posting offsets, rendered before the index is loaded
+POSTINGS_FILE = "bio_postings.npy" # Sorted FAISS ids per facet value, concatenated (int32)
 BATCH_SIZE = 100
+MODEL_NAME = "all-MiniLM-L6-v2"
+SHARD_INDEX_TEMPLATE = "bio_faiss.shard{}.index"
+SHARD_META_TEMPLATE = "bio_meta.shard{}.pkl"
+SHARD_MANIFEST_FILE = "bio_shards.json"
+VECTOR_FILE = "bio_vectors.mmap"   # Memory-mapped embedding matrix, filled chunk by chunk
+VECTOR_KEYS_FILE = "bio_vectors.keys.json"   # Row key per vector + encode order; unchanged rows are reused
+CHECKPOINT_FILE = "bio_vectors.checkpoint.json"
+VECTOR_DTYPE = "float32"           # "float16" halves the vector file; the index is always float32
+ENCODE_CHUNK_SIZE = 5000           # Documents per checkpoint
+ENCODE_WORKERS = os.cpu_count() or 1
+INDEX_ADD_BLOCK = 50000
+SNAPSHOT_KEEP = 3                   # Older versions are pruned (current + previous always kept)
+
+def assign_shards(metadata_lookup, num_shards, shard_by="hash"):
+    """
+    hash: stable crc32 of repository+accession, spreads every query over all shards evenly.
+    repository: whole repositories per shard (largest first onto the emptiest shard),
+                so repository-filtered queries can skip shards.
+    """
+    if shard_by == "repository":
+        sizes = {}
+        for m in metadata_lookup:
+            sizes[m["repository"]] = sizes.get(m["repository"], 0) + 1
+        loads = [0] * num_shards
+        repo_shard = {}
+        for repo, n in sorted(sizes.items(), key=lambda x: -x[1]):
+            target = loads.index(min(loads))
+            repo_shard[repo] = target
+            loads[target] += n
+        return np.array([repo_shard[m["repository"]] for m in metadata_lookup], dtype='int64')
+
+    keys = [f"{m['repository']}:{m['accession_id']}" for m in metadata_lookup]
+    return np.array([zlib.crc32(k.encode("utf-8")) % num_shards for k in keys], dtype='int64')
+
+def write_shards(embeddings, metadata_lookup, num_shards, shard_by="hash"):
+    """Splits the vectors into num_shards flat indexes + metadata files and a manifest; returns the files written."""
+    assignment = assign_shards(metadata_lookup, num_shards, shard_by)
+    manifest = {"num_shards": num_shards, "shard_by": shard_by, "dimension": int(embeddings.shape[1]),
+                "model_name": MODEL_NAME, "total": len(metadata_lookup), "shards": []}
+
+    for shard in range(num_shards):
+        rows = np.flatnonzero(assignment == shard)
+        index = faiss.IndexFlatL2(embeddings.shape[1])
+        if len(rows): index.add(np.ascontiguousarray(embeddings[rows], dtype='float32'))
+        shard_meta = [metadata_lookup[i] for i in rows]
+
+        faiss.write_index(index, SHARD_INDEX_TEMPLATE.format(shard))
+        with open(SHARD_META_TEMPLATE.format(shard), "wb") as f:
+            pickle.dump(shard_meta, f)
+        manifest["shards"].append({
+            "shard": shard,
+            "index_file": SHARD_INDEX_TEMPLATE.format(shard),
+            "meta_file": SHARD_META_TEMPLATE.format(shard),
+            "count": len(rows),
+            "repositories": sorted({m["repository"] for m in shard_meta}),
+        })
+        print(f"    - Shard {shard}: {len(rows)} vectors")
+
+    with open(SHARD_MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[*] Shard manifest saved to {SHARD_MANIFEST_FILE}")
+    return [SHARD_MANIFEST_FILE] + [f for sh in manifest["shards"] for f in (sh["index_file"], sh["meta_file"])]
+
+def flip_current(version, snapshot_dir=SNAPSHOT_DIR):
+    """Atomically points CURRENT at version (write temp file, then rename over)."""
+    pointer = os.path.join(snapshot_dir, CURRENT_POINTER)
+    tmp_pointer = pointer + ".tmp"
+    with open(tmp_pointer, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, pointer)
+
+def publish_snapshot(index_file, meta_file, build_params, snapshot_dir=SNAPSHOT_DIR, extra_files=()):
+    """
+    Copies a finished build into snapshots/<version>/ with a manifest of checksums and
+    build parameters. The directory is staged under a temp name and renamed into place,
+    so readers only ever see complete snapshots; then CURRENT is flipped.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    previous = read_current_version(snapshot_dir)
+    index_sha = file_sha256(index_file)
+    version = time.strftime("%Y%m%dT%H%M%S") + "-" + index_sha[:8]
+
+    staging = os.path.join(snapshot_dir, f".staging-{version}")
+    os.makedirs(staging)
+    shutil.copyfile(index_file, os.path.join(staging, INDEX_FILE))
+    shutil.copyfile(meta_file, os.path.join(staging, META_FILE))
+    for extra in extra_files:
+        shutil.copyfile(extra, os.path.join(staging, os.path.basename(extra)))
+
+    manifest = {
+        "version": version,
+        "previous": previous,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": {
+            INDEX_FILE: {"sha256": index_sha, "bytes": os.path.getsize(index_file)},
+            META_FILE: {"sha256": file_sha256(meta_file), "bytes": os.path.getsize(meta_file)},
+            **{os.path.basename(extra): {"sha256": file_sha256(extra), "bytes": os.path.getsize(extra)} for extra in extra_files},
+        },
+        "build": build_params,
+    }
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(staging, os.path.join(snapshot_dir, version))
+    flip_current(version, snapshot_dir)
+    print(f"[*] Published snapshot {version} (previous: {previous})")
+
+    prune_snapshots(snapshot_dir, keep={version, previous})
+    return version
+
+def prune_snapshots(snapshot_dir=SNAPSHOT_DIR, keep=()):
+    versions = sorted(d for d in os.listdir(snapshot_dir)
+                      if not d.startswith(".") and os.path.isdir(os.path.join(snapshot_dir, d)))
+    for old in versions[:-SNAPSHOT_KEEP]:
+        if old not in keep:
+            shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+            print(f"[*] Pruned old snapshot {old}")
+
+def rollback_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Points CURRENT back at the version the live snapshot replaced."""
+    current = read_current_version(snapshot_dir)
+    if not current:
+        print(f"[!] No current snapshot in {snapshot_dir}")
+        return
+    with open(os.path.join(snapshot_dir, current, "manifest.json"), "r") as f:
+        previous = json.load(f).get("previous")
+    if not previous or not os.path.isdir(os.path.join(snapshot_dir, previous)):
+        print(f"[!] Snapshot {current} has no previous version to roll back to.")
+        return
+    flip_current(previous, snapshot_dir)
+    print(f"[*] Rolled back {current} -> {previous}")
+
+def save_atomic(write_fn, path):
+    """Writes via a temp file + rename so a reader never picks up a half-written file."""
+    tmp_path = path + ".tmp"
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+def build_document(row):
+    bio_name = str(row.get('Bio_Name', 'Unknown'))
+    bio_cat = str(row.get('Bio_Category', 'Unknown'))
+    bio_app = str(row.get('Bio_Application', 'Unknown'))
+    snippet = str(row.get('Context_Snippet', ''))
+    title = str(row.get('Title', ''))
+    return f"Organism: {bio_name}. Category: {bio_cat}. Application: {bio_app}. Title: {title}. Context: {snippet}"
+
+def build_metadata(row):
+    return {
+        "accession_id": str(row['Accession_ID']),
+        "repository": str(row['Repository']),
+        "name": str(row.get('Bio_Name', 'Unknown')),
+        "category": str(row.get('Bio_Category', 'Unknown')),
+        "application": str(row.get('Bio_Application', 'Unknown')),
+        "title": str(row.get('Title', ''))
+    }
+
+def row_key(row, document):
+    """
+    Lens_ID|Accession_ID|Updated_At plus a digest of the embedded text: a vector is only
+    reused for the same asset version rendered into the same document.
+    """
+    digest = hashlib.sha1(document.encode("utf-8")).hexdigest()[:16]
+    return f"{row.get('Lens_ID', '')}|{row['Accession_ID']}|{row.get('Updated_At', '')}|{digest}"
+
+def load_vector_store(layout):
+    """
+    The previous VECTOR_FILE's keys, encode order and progress, if it was written with
+    this model/dimension/dtype and its checkpoint is intact; None otherwise.
+    """
+    if not all(os.path.exists(f) for f in (VECTOR_FILE, VECTOR_KEYS_FILE, CHECKPOINT_FILE)): return None
+    with open(VECTOR_KEYS_FILE, "r") as f:
+        store = json.load(f)
+    with open(CHECKPOINT_FILE, "r") as f:
+        checkpoint = json.load(f)
+    if any(store.get(k) != v for k, v in layout.items()) or checkpoint.get("layout_id") != store.get("layout_id"): return None
+    store["chunks_done"] = checkpoint.get("chunks_done", 0)
+    return store
+
+def write_checkpoint(layout_id, chunks_done):
+    with open(CHECKPOINT_FILE + ".tmp", "w") as f:
+        json.dump({"layout_id": layout_id, "chunks_done": chunks_done}, f)
+    os.replace(CHECKPOINT_FILE + ".tmp", CHECKPOINT_FILE)
 
-def create_embeddings():
+def new_vector_layout(keys, lengths, layout, store):
+    """
+    Starts VECTOR_FILE for a new set of rows. Vectors of rows whose key is unchanged since
+    the previous build are copied over; only the rest are queued for encoding, longest first.
+    Returns (layout_id, encode order).
+    """
+    reuse = {}   # new row -> old row
+    if store:
+        old_rows = {k: i for i, k in enumerate(store["keys"])}
+        pending = set(store["todo"][store["chunks_done"] * store["chunk_size"]:])
+        reuse = {i: old_rows[k] for i, k in enumerate(keys) if k in old_rows and old_rows[k] not in pending}
+    todo = [int(i) for i in np.argsort(-lengths, kind='stable') if int(i) not in reuse]
+
+    # Drop the checkpoint first: a crash part-way through then means a clean rebuild, never mixed rows
+    if os.path.exists(CHECKPOINT_FILE): os.remove(CHECKPOINT_FILE)
+    vectors = np.memmap(VECTOR_FILE + ".tmp", dtype=VECTOR_DTYPE, mode="w+", shape=(len(keys), layout["dimension"]))
+    if reuse:
+        old = np.memmap(VECTOR_FILE, dtype=VECTOR_DTYPE, mode="r", shape=(len(store["keys"]), layout["dimension"]))
+        new_idx = np.fromiter(reuse.keys(), dtype='int64', count=len(reuse))
+        old_idx = np.fromiter(reuse.values(), dtype='int64', count=len(reuse))
+        with span("io.reuse_vectors"):
+            for start in range(0, len(new_idx), INDEX_ADD_BLOCK):
+                vectors[new_idx[start:start + INDEX_ADD_BLOCK]] = old[old_idx[start:start + INDEX_ADD_BLOCK]]
+        del old
+    vectors.flush()
+    del vectors
+    os.replace(VECTOR_FILE + ".tmp", VECTOR_FILE)
+
+    layout_id = time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+    def dump_keys(path):
+        with open(path, "w") as f:
+            json.dump({**layout, "layout_id": layout_id, "chunk_size": ENCODE_CHUNK_SIZE, "keys": keys, "todo": todo}, f)
+    save_atomic(dump_keys, VECTOR_KEYS_FILE)
+    write_checkpoint(layout_id, 0)
+    inc("vectors_reused_total", len(reuse))
+    print(f"[*] Reusing {len(reuse)} vectors from the previous build; {len(todo)} new or changed documents to encode.")
+    return layout_id, todo
+
+def encode_documents(df):
+    """
+    Streams documents through the model in ENCODE_CHUNK_SIZE chunks, sorted longest
+    first so every batch holds similar lengths (little padding). Vectors land in a
+    memory-mapped VECTOR_FILE at their row position. Rows unchanged since the last build
+    (see row_key) keep their vectors, and CHECKPOINT_FILE records finished chunks, so a
+    delta refresh only encodes what changed and an interrupted build resumes where it
+    stopped. Uses a pool of ENCODE_WORKERS CPU processes when > 1.
+    """
+    n = len(df)
+    print(f"[*] Keying {n} documents...")
+    keys, lengths = [], np.zeros(n, dtype='int64')
+    for i, (_, row) in enumerate(df.iterrows()):
+        document = build_document(row)
+        keys.append(row_key(row, document))
+        lengths[i] = len(document)
+
+    if ENCODE_WORKERS > 1:
+        # Each worker process runs its own torch; split the cores instead of oversubscribing them
+        os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // ENCODE_WORKERS)))
+
+    print(f"[*] Loading Model ({MODEL_NAME})...")
+    model = SentenceTransformer(MODEL_NAME)
+    dimension = model.get_sentence_embedding_dimension()
+
+    layout = {"model_name": MODEL_NAME, "dimension": dimension, "dtype": VECTOR_DTYPE}
+    store = load_vector_store(layout)
+    if store and store["keys"] == keys:
+        layout_id, todo, chunk_size, chunks_done = store["layout_id"], store["todo"], store["chunk_size"], store["chunks_done"]
+    else:
+        layout_id, todo = new_vector_layout(keys, lengths, layout, store)
+        chunk_size, chunks_done = ENCODE_CHUNK_SIZE, 0
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    if chunks_done == len(chunks):
+        print(f"[*] All {n} vectors are up to date in {VECTOR_FILE}.")
+    elif chunks_done:
+        print(f"[*] Resuming: {chunks_done}/{len(chunks)} chunks already encoded.")
+    embeddings = np.memmap(VECTOR_FILE, dtype=VECTOR_DTYPE, mode="r+", shape=(n, dimension))
+
+    pool = None
+    if ENCODE_WORKERS > 1 and len(chunks) > chunks_done:
+        print(f"[*] Starting {ENCODE_WORKERS} encode workers...")
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * ENCODE_WORKERS)
+
+    print("[*] Generating Vectors (This uses CPU/GPU)...")
+    start_time = time.time()
+    encoded = 0
+    try:
+        for c in range(chunks_done, len(chunks)):
+            rows = chunks[c]
+            documents = [build_document(df.iloc[i]) for i in rows]
+            with span("model.encode", workers=str(ENCODE_WORKERS)):
+                if pool:
+                    vectors = model.encode_multi_process(documents, pool, batch_size=BATCH_SIZE)
+                else:
+                    vectors = model.encode(documents, batch_size=BATCH_SIZE, show_progress_bar=False)
+            with span("io.write_vectors"):
+                embeddings[rows] = np.asarray(vectors, dtype=VECTOR_DTYPE)
+                embeddings.flush()
+            inc("rows_total", len(rows))
+            write_checkpoint(layout_id, c + 1)
+
+            encoded += len(rows)
+            rate = encoded / max(time.time() - start_time, 1e-9)
+            remaining = sum(len(ch) for ch in chunks[c + 1:]) / max(rate, 1e-9)
+            print(f" -> Chunk {c + 1}/{len(chunks)} | {rate:.0f} docs/s | ETA {remaining / 60:.1f} min", end='\r')
+    finally:
+        if pool: model.stop_multi_process_pool(pool)
+
+    if encoded:
+        print(f"\n[*] Encoded {encoded} documents in {(time.time() - start_time) / 60:.1f} min ({encoded / max(time.time() - start_time, 1e-9):.0f} docs/s)")
+    del embeddings
+    return np.memmap(VECTOR_FILE, dtype=VECTOR_DTYPE, mode="r", shape=(n, dimension))
+
+def create_embeddings(num_shards=0, shard_by="hash", publish=True):
     print(f"[*] Loading Data from {INPUT_FILE}...")
     if not os.path.exists(INPUT_FILE):
         print("[!] File not found. Run Step 3 first.")
         return
 
-    df = pd.read_csv(INPUT_FILE)
+    with span("io.read_csv"):
+        df = pd.read_csv(INPUT_FILE)
     
     df = df[df['Bio_Name'].notna() & (df['Bio_Name'] != "Unknown")]
     print(f"[*] Found {len(df)} valid assets to embed.")
 
-    print("[*] constructing Rich Documents...")
-    documents = []
-    metadata_lookup = []
-    
-    for idx, row in df.iterrows():
-        bio_name = str(row.get('Bio_Name', 'Unknown'))
-        bio_cat = str(row.get('Bio_Category', 'Unknown'))
-        bio_app = str(row.get('Bio_Application', 'Unknown'))
-        snippet = str(row.get('Context_Snippet', ''))
-        title = str(row.get('Title', ''))
-        
-        rich_text = f"Organism: {bio_name}. Category: {bio_cat}. Application: {bio_app}. Title: {title}. Context: {snippet}"
-        documents.append(rich_text)
-        
-        metadata_lookup.append({
-            "accession_id": str(row['Accession_ID']),
-            "repository": str(row['Repository']),
-            "name": bio_name,
-            "category": bio_cat,
-            "application": bio_app,
-            "title": title
-        })
+    df = df.reset_index(drop=True)
+    metadata_lookup = [build_metadata(row) for _, row in df.iterrows()]
 
-    print("[*] Loading Model (all-MiniLM-L6-v2)...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    print("[*] Generating Vectors (This uses CPU/GPU)...")
-    embeddings = model.encode(documents, batch_size=BATCH_SIZE, show_progress_bar=True)
-    
-    embeddings = np.array(embeddings).astype('float32')
+    embeddings = encode_documents(df)
     dimension = embeddings.shape[1]
 
-    print(f"[*] Building FAISS Index (Dim={dimension})...")
+    print(f"[*] Building FAISS Index (Dim={dimension}) from {VECTOR_FILE}...")
     index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
+    with span("index.add"):
+        for start in range(0, len(embeddings), INDEX_ADD_BLOCK):
+            index.add(np.ascontiguousarray(embeddings[start:start + INDEX_ADD_BLOCK], dtype='float32'))
     
     print(f"[*] Saving Index to {INDEX_FILE}...")
-    faiss.write_index(index, INDEX_FILE)
+    save_atomic(lambda path: faiss.write_index(index, path), INDEX_FILE)
     
     print(f"[*] Saving Metadata to {META_FILE}...")
-    with open(META_FILE, "wb") as f:
-        pickle.dump(metadata_lookup, f)
+    def dump_meta(path):
+        with open(path, "wb") as f:
+            pickle.dump(metadata_lookup, f)
+    save_atomic(dump_meta, META_FILE)
+
+    print(f"[*] Saving Facet Index to {SUMMARY_FILE} + {POSTINGS_FILE}...")
+    summary, postings = build_facet_index(metadata_lookup)
+    def dump_summary(path):
+        with open(path, "w") as f:
+            json.dump(summary, f)
+    def dump_postings(path):
+        with open(path, "wb") as f:
+            np.save(f, postings)
+    save_atomic(dump_summary, SUMMARY_FILE)
+    save_atomic(dump_postings, POSTINGS_FILE)
+
+    # Shards go into the snapshot too, so shard_serving serves the same version as the app
+    shard_files = []
+    if num_shards > 1:
+        print(f"[*] Writing {num_shards} shards (by {shard_by})...")
+        shard_files = write_shards(embeddings, metadata_lookup, num_shards, shard_by)
+
+    if publish:
+        publish_snapshot(INDEX_FILE, META_FILE, {
+            "model_name": MODEL_NAME,
+            "batch_size": BATCH_SIZE,
+            "vector_dtype": VECTOR_DTYPE,
+            "dimension": int(dimension),
+            "vectors": int(index.ntotal),
+            "index_type": type(index).__name__,
+            "input_file": INPUT_FILE,
+            "input_sha256": file_sha256(INPUT_FILE),
+        }, extra_files=[SUMMARY_FILE, POSTINGS_FILE] + shard_files)
         
     print("\n[SUCCESS] Vector Database Built Successfully!")
 
@@ -74,12 +391,14 @@ def test_query():
     index = faiss.read_index(INDEX_FILE)
     with open(META_FILE, "rb") as f:
         meta_data = pickle.load(f)
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    model = SentenceTransformer(MODEL_NAME)
   
     query = "Bacteria capable of degrading oil or hydrocarbons"
-    vec = model.encode([query]).astype('float32')
+    with span("model.encode"):
+        vec = model.encode([query]).astype('float32')
     
-    D, I = index.search(vec, k=3)
+    with span("index.search", filtered="no"):
+        D, I = index.search(vec, k=3)
     
     for i, idx in enumerate(I[0]):
         if idx < len(meta_data):
@@ -90,5 +409,21 @@ def test_query():
             print(f"  App: {item['application']}")
 
 if __name__ == "__main__":
-    create_embeddings()
-    test_query()
+    parser = argparse.ArgumentParser(description="Embed Step5 output into a FAISS index.")
+    parser.add_argument("--shards", type=int, default=0, help="Also write N shard indexes for shard_serving.py")
+    parser.add_argument("--shard-by", choices=["hash", "repository"], default="hash", help="How vectors are split across shards")
+    parser.add_argument("--workers", type=int, default=ENCODE_WORKERS, help="CPU encode processes (1 = single process)")
+    parser.add_argument("--float16", action="store_true", help=f"Store {VECTOR_FILE} as float16")
+    parser.add_argument("--no-publish", action="store_true", help=f"Do not publish a versioned snapshot to {SNAPSHOT_DIR}/")
+    parser.add_argument("--rollback", action="store_true", help=f"Point {SNAPSHOT_DIR}/{CURRENT_POINTER} back at the previous snapshot and exit")
+    args = parser.parse_args()
+    init("step6")
+
+    ENCODE_WORKERS = max(1, args.workers)
+    if args.float16: VECTOR_DTYPE = "float16"
+
+    if args.rollback:
+        rollback_snapshot()
+    else:
+        create_embeddings(num_shards=args.shards, shard_by=args.shard_by, publish=not args.no_publish)
+        test_query()
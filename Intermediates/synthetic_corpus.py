@@ -0,0 +1,164 @@
+import datetime
+import random
+from typing import Dict, List, Optional
+
+# Seeded generator of Lens-shaped patent records with known ground truth, shared by
+# mock_lens_server.py (fixtures) and benchmark.py (corpora, labelled queries).
+
+SEED = 42
+
+BIO_IPC_CODES = ["C12N15/10", "C12N1/20", "C07K16/28", "A61K39/395", "A01H5/00", "C12Q1/68", "C07H21/04", "A23L33/135"]
+OTHER_IPC_CODES = ["G06F17/30", "H04L29/06", "B65D81/00"]
+PATENT_STATUSES = ["EXPIRED", "LAPSED", "REVOKED", "CEASED", "ACTIVE", "PENDING"]
+
+# repository -> [(name as written in the text, accession id template)] in forms step2's
+# ALL_PATTERNS recognise. Repositories not listed use the generic "<ACRONYM> Accession No. <digits>".
+REPOSITORY_TEMPLATES = {
+    "ATCC": [("ATCC", "PTA-{n4}"), ("ATCC", "CRL-{n4}"), ("ATCC", "HB-{n4}"), ("ATCC", "CCL-{n3}"), ("ATCC", "{n5}")],
+    "ECACC": [("ECACC", "{n8}"), ("ECACC", "V{n5}")],
+    "DSMZ": [("DSM", "DSM {n5}")],
+    "NRRL": [("NRRL", "B-{n5}"), ("NRRL", "Y-{n4}")],
+    "IPOD": [("", "FERM BP-{n4}"), ("", "FERM P-{n5}")],
+    "CBS": [("CBS", "{n3}.{n2}")],
+    "CCTCC": [("CCTCC", "M 2{n5}")],
+    "KCTC": [("KCTC", "{n5}")],
+    "MTCC": [("MTCC", "{n4}")],
+}
+
+# application -> organisms (name, category) described with it
+APPLICATIONS = {
+    "Hydrocarbon degradation": [("Pseudomonas putida", "Bacteria"), ("Alcanivorax borkumensis", "Bacteria"), ("Rhodococcus erythropolis", "Bacteria")],
+    "Monoclonal antibody production": [("Anti-CD20 hybridoma", "Hybridoma"), ("Anti-TNF hybridoma", "Hybridoma")],
+    "Ethanol fermentation": [("Saccharomyces cerevisiae", "Yeast"), ("Zymomonas mobilis", "Bacteria")],
+    "Probiotic food supplement": [("Lactobacillus rhamnosus", "Bacteria"), ("Bifidobacterium longum", "Bacteria")],
+    "Vaccine antigen expression": [("CHO-K1", "Mammalian Cell Line"), ("Vero", "Mammalian Cell Line")],
+    "Plant pest biocontrol": [("Bacillus thuringiensis", "Bacteria"), ("Trichoderma harzianum", "Fungi")],
+    "Antibiotic biosynthesis": [("Streptomyces coelicolor", "Bacteria"), ("Penicillium chrysogenum", "Fungi")],
+    "Gene delivery": [("pUC19 expression plasmid", "Plasmid/Vector"), ("Adeno-associated virus vector", "Virus")],
+}
+
+# Paraphrased queries; every record whose application matches is relevant
+LABELLED_QUERIES = [
+    {"query": "Bacteria capable of degrading oil or hydrocarbons", "application": "Hydrocarbon degradation"},
+    {"query": "bioremediation of petroleum spills", "application": "Hydrocarbon degradation"},
+    {"query": "hybridoma cell line secreting a monoclonal antibody", "application": "Monoclonal antibody production"},
+    {"query": "yeast strain for producing bioethanol", "application": "Ethanol fermentation"},
+    {"query": "probiotic lactic acid bacteria for gut health", "application": "Probiotic food supplement"},
+    {"query": "mammalian cells expressing a vaccine protein", "application": "Vaccine antigen expression"},
+    {"query": "microbial insecticide protecting crops", "application": "Plant pest biocontrol"},
+    {"query": "actinomycete producing antibiotics", "application": "Antibiotic biosynthesis"},
+    {"query": "viral vector or plasmid for gene therapy", "application": "Gene delivery"},
+]
+
+FILLER = ("The invention relates to an isolated strain, cell line or plasmid and to methods of producing "
+          "recombinant proteins, antibodies and fermentation products using the same. ")
+
+def _digits(rng: random.Random, n: int) -> str:
+    return str(rng.randrange(10 ** (n - 1), 10 ** n))
+
+def deposit_mention(rng: random.Random, repository: str) -> tuple:
+    """(text, expected accession id as step2 extracts it) for one deposit in the repository."""
+    prefix, template = rng.choice(REPOSITORY_TEMPLATES.get(repository, [(repository, "{n5}")]))
+    acc_id = template.format(n2=_digits(rng, 2), n3=_digits(rng, 3), n4=_digits(rng, 4), n5=_digits(rng, 5), n8=_digits(rng, 8))
+    text = f"deposited as {acc_id}" if not prefix else f"deposited as {prefix} Accession No. {acc_id}"
+    return text, acc_id.upper()
+
+def synthetic_patents(n: int, seed: int = SEED, repositories: Optional[List[str]] = None,
+                      deposit_rate: float = 0.6) -> List[dict]:
+    """
+    Deterministic Lens-shaped patent records: roughly 70% bio IPC, mixed statuses, and
+    deposit mentions cycling through `repositories` (default: REPOSITORY_TEMPLATES) so each
+    appears. Ground truth is kept under underscore keys, which the mock server never returns:
+    _deposits [(repository, accession_id)], _organism, _category, _application.
+    """
+    rng = random.Random(seed)
+    repositories = repositories or list(REPOSITORY_TEMPLATES)
+    applications = list(APPLICATIONS)
+    next_repo = 0
+    patents = []
+    for i in range(n):
+        published = datetime.date(1995, 1, 1) + datetime.timedelta(days=rng.randrange(30 * 365))
+        status = rng.choice(PATENT_STATUSES)
+        codes = rng.sample(BIO_IPC_CODES, rng.randint(1, 3)) if rng.random() < 0.7 else rng.sample(OTHER_IPC_CODES, 1)
+        application = rng.choice(applications)
+        organism, category = rng.choice(APPLICATIONS[application])
+
+        deposits, mentions = [], []
+        if rng.random() < deposit_rate:
+            for _ in range(rng.randint(1, 3)):
+                repo = repositories[next_repo % len(repositories)]
+                next_repo += 1
+                text, acc_id = deposit_mention(rng, repo)
+                mentions.append(text)
+                deposits.append((repo, acc_id))
+
+        description = FILLER * rng.randint(2, 20)
+        description += f"In particular, {organism} ({category.lower()}) is used for {application.lower()}. "
+        claims = [f"A composition comprising the microorganism of claim {c}." for c in range(1, rng.randint(2, 8))]
+        if mentions:
+            description += "The strain was " + "; ".join(mentions) + " pursuant to the Budapest Treaty. "
+            if rng.random() < 0.5: claims.append(f"The method of claim 1, wherein the strain is {mentions[0]}.")
+
+        legal_status = {"patent_status": status, "anticipated_term_date": str(published + datetime.timedelta(days=20 * 365))}
+        if status in ("LAPSED", "REVOKED", "CEASED"):
+            legal_status["discontinuation_date"] = str(published + datetime.timedelta(days=rng.randrange(365, 15 * 365)))
+
+        patents.append({
+            "lens_id": f"{i:03d}-{rng.randrange(1000):03d}-{rng.randrange(1000):03d}-{rng.randrange(1000):03d}-{rng.randrange(1000):03d}",
+            "date_published": str(published),
+            "class_ipc": [{"symbol": c} for c in codes],
+            "legal_status": legal_status,
+            "biblio": {"invention_title": [{"text": f"{application} using {organism}", "lang": "en"}]},
+            "description": {"text": description},
+            "claims": [{"claims": [{"claim_text": [c]} for c in claims], "lang": "en"}],
+            "_deposits": deposits,
+            "_organism": organism,
+            "_category": category,
+            "_application": application,
+        })
+    return patents
+
+def full_text(patent: dict) -> str:
+    """description + claims, the text step2 scans for accession ids."""
+    claims = " ".join(c for block in patent["claims"] for claim in block["claims"] for c in claim["claim_text"])
+    return patent["description"]["text"] + " " + claims
+
+def step5_rows(patents: List[dict]) -> List[Dict]:
+    """One Step5_Output-shaped row per ground-truth deposit."""
+    rows = []
+    for p in patents:
+        for repo, acc_id in p["_deposits"]:
+            rows.append({
+                "Accession_ID": acc_id, "Repository": repo, "Lens_ID": p["lens_id"],
+                "Title": p["biblio"]["invention_title"][0]["text"],
+                "Bio_Name": p["_organism"], "Bio_Category": p["_category"], "Bio_Application": p["_application"],
+                "Context_Snippet": p["description"]["text"][-400:],
+                "Updated_At": p["date_published"],
+            })
+    return rows
+
+def step4_rows(patents: List[dict], seed: int = SEED) -> List[Dict]:
+    """
+    Step4_Output-shaped rows with the noise step5 repairs: failed JSON with a rescuable
+    Raw_Response, and generic names (human, hybridoma, plasmid, bacteria).
+    """
+    rng = random.Random(seed)
+    rows = []
+    for row in step5_rows(patents):
+        row = dict(row, Bio_Strain="Unknown", LLM_Status="Success", Raw_Response="")
+        roll = rng.random()
+        if roll < 0.10:
+            row["Raw_Response"] = (f'Sure! {{"name": "{row["Bio_Name"]}", "category": "{row["Bio_Category"]}", '
+                                   f'"application": "{row["Bio_Application"]}" and the strain is unknown')
+            row.update(Bio_Name="Unknown", Bio_Category="Error", Bio_Application="Unknown", LLM_Status="JSON Failed")
+        elif roll < 0.15:
+            row["Bio_Name"] = "Human"
+        elif roll < 0.20:
+            row["Bio_Name"] = "Mouse hybridoma"
+        elif roll < 0.25:
+            row["Bio_Name"] = "Expression plasmid"
+        elif roll < 0.30:
+            row.update(Bio_Name="bacteria", Bio_Category="Other")
+        del row["Context_Snippet"]
+        rows.append(row)
+    return rows
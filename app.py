@@ -1,106 +1,131 @@
 import streamlit as st
-import faiss
-import pickle
 import os
-import glob
-from sentence_transformers import SentenceTransformer
+import instrumentation
+from search_engine import (INDEX_FILE, META_FILE, TOP_K, WARMUP_TIMEOUT_S, reconstruct_file,
+                           read_current_version, load_summary, WarmUp, SearchCache, CursorExpired, start_readiness_server)
 
 # 0. GITHUB FIX (File Stitching)
-def reconstruct_file(filename):
-    if not os.path.exists(filename):
-        parts = sorted(glob.glob(f"{filename}.part*"))
-        if parts:
-            with open(filename, "wb") as outfile:
-                for part in parts:
-                    with open(part, "rb") as infile:
-                        outfile.write(infile.read())
-
-reconstruct_file("bio_faiss.index")
-reconstruct_file("bio_meta.pkl")
+reconstruct_file(INDEX_FILE)
+reconstruct_file(META_FILE)
 
 # 1. SETUP
 st.set_page_config(page_title="BioSearch", page_icon="🧬", layout="wide")
-INDEX_FILE = "bio_faiss.index"
-META_FILE = "bio_meta.pkl"
+instrumentation.init("app")   # /metrics is served next to /ready
 
-# DIAGNOSTICS: Check if files exist on Cloud
-if not os.path.exists(INDEX_FILE):
+# DIAGNOSTICS: Check if files exist on Cloud (not needed when serving published snapshots)
+HAS_SNAPSHOTS = read_current_version() is not None
+if not HAS_SNAPSHOTS and not os.path.exists(INDEX_FILE):
     st.error(f"❌ Missing File: {INDEX_FILE}")
     st.write("Files in directory:", os.listdir('.'))
     st.stop()
-if not os.path.exists(META_FILE):
+if not HAS_SNAPSHOTS and not os.path.exists(META_FILE):
     st.error(f"❌ Missing File: {META_FILE}")
     st.stop()
 
 @st.cache_resource
 def load_resources():
-    # Load Index
-    index = faiss.read_index(INDEX_FILE)
-    # Load Metadata
-    with open(META_FILE, "rb") as f:
-        metadata = pickle.load(f)
-    # Load Model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    return index, metadata, model
+    # Heavy imports, index/metadata and model load in the background; the page renders meanwhile
+    warmup = WarmUp().start()
+    start_readiness_server(warmup)
+    return warmup
 
-# 2. LOAD WITH ERROR VISIBILITY
-try:
-    index, metadata, model = load_resources()
-except Exception as e:
-    st.error(f"⚠️ SYSTEM CRASH: {e}")
-    st.info("Debugging Info:")
-    st.json({
-        "Python Version": os.sys.version,
-        "Meta File Size (Bytes)": os.path.getsize(META_FILE),
-        "Index File Size (Bytes)": os.path.getsize(INDEX_FILE)
-    })
-    st.stop()
+@st.cache_resource
+def load_search_cache():
+    # Candidate lists shared across sessions so "Load more" continues instead of re-searching
+    return SearchCache()
+
+@st.cache_data
+def load_page_summary(version):
+    return load_summary(version)
+
+warmup = load_resources()
+search_cache = load_search_cache()
+
+# One snapshot per run: a swap mid-query never mixes an old index with new metadata
+snapshot = warmup.snapshots.current() if warmup.snapshots else None
+version = snapshot.version if snapshot else (read_current_version() or "legacy")
+summary = load_page_summary(version)
 
 # 3. HEADER
 st.title("🧬 BioSearch")
-st.markdown(f"Search **{len(metadata):,}** open-source organisms liberated from expired patents.")
+st.markdown(f"Search **{summary['count']:,}** open-source organisms liberated from expired patents.")
 
 # 4. SIDEBAR
 st.sidebar.header("Filter Results")
-# Handle potential missing categories
-valid_cats = [m['category'] for m in metadata if isinstance(m, dict) and 'category' in m]
-all_cats = sorted(list(set(valid_cats))) if valid_cats else []
-cat_filter = st.sidebar.multiselect("Category", all_cats)
+# Facet values and counts come precomputed from step6 (missing facets are simply not shown)
+selections = {}
+for facet, label in [("category", "Category"), ("repository", "Repository"), ("year", "Patent Year")]:
+    counts = summary.get(facet, {})
+    if counts:
+        selections[facet] = st.sidebar.multiselect(label, sorted(counts), format_func=lambda v, c=counts: f"{v} ({c[v]:,})")
+min_score = st.sidebar.slider("Minimum Match %", 0, 100, 0, help="0 = ranked results; above 0 = every organism scoring at least this much")
+st.sidebar.caption(f"Index version: {version}")
 
 # 5. SEARCH ENGINE
 query = st.text_input("What are you looking for?", placeholder="e.g. 'Yeast for ethanol' or 'CHO cell line'")
 
+if query and not warmup.ready.is_set():
+    with st.spinner("Warming up the search engine..."):
+        warmup.wait(WARMUP_TIMEOUT_S)
+    if not warmup.ready.is_set():
+        st.warning("⏳ Still loading the Bio-Archive. Please try again in a moment.")
+        st.stop()
+
+# 2. LOAD WITH ERROR VISIBILITY
+if query and warmup.errors:
+    st.error(f"⚠️ SYSTEM CRASH: {'; '.join(warmup.errors)}")
+    st.info("Debugging Info:")
+    st.json({
+        "Python Version": os.sys.version,
+        "Snapshot": read_current_version() or "none (flat files)",
+        "Meta File Size (Bytes)": os.path.getsize(META_FILE) if os.path.exists(META_FILE) else None,
+        "Index File Size (Bytes)": os.path.getsize(INDEX_FILE) if os.path.exists(INDEX_FILE) else None,
+        "Startup Timings (s)": warmup.timings
+    })
+    st.stop()
+
 if query:
-    with st.spinner("Scanning Bio-Archive..."):
-        vec = model.encode([query]).astype('float32')
-        D, I = index.search(vec, k=100)
-        
-        results = []
-        for dist, idx in zip(D[0], I[0]):
-            if idx < len(metadata):
-                item = metadata[idx]
-                
-                if cat_filter and item['category'] not in cat_filter: 
-                    continue
-                
-                score = round((1 - dist) * 100, 1)
-                results.append({**item, "score": score})
-                if len(results) >= 15: break
-        
-        if results:
-            st.success(f"Found {len(results)} matches.")
-            for res in results:
-                with st.expander(f"**{res['name']}** ({res['category']}) - {res['score']}% Match"):
-                    c1, c2 = st.columns([3, 1])
-                    with c1:
-                        st.markdown(f"**💡 Application:** {res.get('application', 'N/A')}")
-                        st.markdown(f"**📜 Patent:** *{res.get('title', 'N/A')}*")
-                        if res.get('lens_id'):
-                            st.markdown(f"🔗 [**View on Lens.org**](https://www.lens.org/lens/patent/{res['lens_id']})")
-                    with c2:
-                        st.metric("Repository", res.get('repository', 'Unknown'))
-                        st.code(res.get('accession_id', ''))
-        else:
-            st.warning("No matches found.")
+    if snapshot is None: snapshot = warmup.snapshots.current()
+    # Results accumulate over "Load more" clicks until the query, filters, threshold or snapshot change
+    search_state = (snapshot.version, query, sorted((f, tuple(v)) for f, v in selections.items()), min_score)
+    if st.session_state.get("search_state") != search_state:
+        with st.spinner("Scanning Bio-Archive..."):
+            # Selected facets become a bitmap allowlist, so FAISS only returns matching organisms
+            results, cursor = search_cache.search_page(snapshot, warmup.model, query, selections,
+                                                       min_score=min_score or None, page_size=TOP_K)
+        st.session_state.update(search_state=search_state, results=results, cursor=cursor)
+
+    results = st.session_state["results"]
+    if results:
+        st.success(f"Found {len(results)} matches." + (" More available below." if st.session_state["cursor"] else ""))
+        for res in results:
+            with st.expander(f"**{res['name']}** ({res['category']}) - {res['score']}% Match"):
+                c1, c2 = st.columns([3, 1])
+                with c1:
+                    st.markdown(f"**💡 Application:** {res.get('application', 'N/A')}")
+                    st.markdown(f"**📜 Patent:** *{res.get('title', 'N/A')}*")
+                    if res.get('lens_id'):
+                        st.markdown(f"🔗 [**View on Lens.org**](https://www.lens.org/lens/patent/{res['lens_id']})")
+                with c2:
+                    st.metric("Repository", res.get('repository', 'Unknown'))
+                    st.code(res.get('accession_id', ''))
+        if st.session_state["cursor"] and st.button("Load more"):
+            try:
+                with st.spinner("Loading more..."):
+                    more, cursor = search_cache.search_page(snapshot, warmup.model, query, selections,
+                                                            min_score=min_score or None, cursor=st.session_state["cursor"], page_size=TOP_K)
+                st.session_state["results"] = results + more
+                st.session_state["cursor"] = cursor
+            except CursorExpired:
+                # The index was swapped since the first page; start over on the new one
+                st.session_state.pop("search_state", None)
+            st.rerun()
+    else:
+        st.warning("No matches found.")
 else:
     st.info("👆 Enter a query above to start discovery.")
+
+with st.sidebar.expander("Startup timings"):
+    st.json(warmup.status())
+with st.sidebar.expander("Latency (s)"):
+    st.json(instrumentation.metrics.snapshot()["histograms"])
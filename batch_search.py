@@ -0,0 +1,162 @@
+import argparse
+import csv
+import os
+import sys
+import time
+import numpy as np
+import faiss
+from typing import Iterator, List
+from instrumentation import init, inc, span
+from search_engine import SNAPSHOT_DIR, TOP_K, collect_hits, load_current_snapshot, load_model, search_index
+
+ENCODE_BATCH_SIZE = 256
+QUERY_CHUNK_SIZE = 4096   # Queries encoded + searched per index.search() call
+OUTPUT_COLUMNS = ["query", "rank", "score", "accession_id", "repository", "name", "category", "title"]
+
+def read_queries(path: str) -> List[dict]:
+    """
+    .txt: one query per line.
+    .csv: a 'query' column, optional 'category' / 'repository' columns
+          (several values separated by '|').
+    """
+    def split(value):
+        return [v.strip() for v in str(value or "").split("|") if v.strip()]
+
+    queries = []
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                text = (row.get("query") or "").strip()
+                if not text: continue
+                queries.append({"query": text, "categories": split(row.get("category")), "repositories": split(row.get("repository"))})
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    queries.append({"query": line.strip(), "categories": [], "repositories": []})
+    return queries
+
+def search_chunks(queries: List[dict], snapshot, model, top_k: int) -> Iterator[List[dict]]:
+    """
+    Encodes and searches QUERY_CHUNK_SIZE queries at a time; yields output rows per chunk.
+    Queries sharing a filter set are searched together under its facet allowlist, so
+    every hit already matches and top_k candidates are enough.
+    """
+    for start in range(0, len(queries), QUERY_CHUNK_SIZE):
+        chunk = queries[start:start + QUERY_CHUNK_SIZE]
+        with span("model.encode"):
+            vecs = model.encode([q["query"] for q in chunk], batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False)
+        vecs = np.ascontiguousarray(vecs, dtype='float32')
+
+        groups = {}
+        for i, q in enumerate(chunk):
+            groups.setdefault((tuple(sorted(set(q["categories"]))), tuple(sorted(set(q["repositories"])))), []).append(i)
+        chunk_hits = [[] for _ in chunk]
+        for (categories, repositories), members in groups.items():
+            allow = snapshot.facets.allow_mask({"category": list(categories), "repository": list(repositories)})
+            D, I = search_index(snapshot.index, vecs[members], min(top_k, snapshot.index.ntotal), allow=allow)
+            for i, dists, ids in zip(members, D, I):
+                chunk_hits[i] = collect_hits(dists, ids, snapshot.metadata, top_k=top_k)
+        inc("queries_total", len(chunk))
+
+        rows = []
+        for q, hits in zip(chunk, chunk_hits):
+            for rank, hit in enumerate(hits, 1):
+                rows.append({
+                    "query": q["query"],
+                    "rank": rank,
+                    "score": hit["score"],
+                    "accession_id": hit.get("accession_id", ""),
+                    "repository": hit.get("repository", ""),
+                    "name": hit.get("name", ""),
+                    "category": hit.get("category", ""),
+                    "title": hit.get("title", ""),
+                })
+        yield rows
+
+class CsvSink:
+    def __init__(self, path):
+        self.f = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.f, fieldnames=OUTPUT_COLUMNS)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class ParquetSink:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("[!] Parquet output needs pyarrow (pip install pyarrow). Use a .csv output instead.")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("query", pa.string()), ("rank", pa.int32()), ("score", pa.float32()),
+            ("accession_id", pa.string()), ("repository", pa.string()), ("name", pa.string()),
+            ("category", pa.string()), ("title", pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        if rows:
+            self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def run_batch_search(input_file: str, output_file: str, top_k: int = TOP_K, threads: int = 0):
+    start_time = time.time()
+    queries = read_queries(input_file)
+    if not queries:
+        print(f"[!] No queries in {input_file}")
+        return
+    print(f"[*] Loaded {len(queries)} queries from {input_file}")
+
+    if threads > 0: faiss.omp_set_num_threads(threads)
+
+    print(f"[*] Loading the current snapshot from {SNAPSHOT_DIR} and model...")
+    snapshot = load_current_snapshot()
+    print(f"[*] Snapshot {snapshot.version}: {snapshot.index.ntotal} vectors")
+    model = load_model()
+    load_time = time.time() - start_time
+
+    sink = ParquetSink(output_file) if output_file.lower().endswith(".parquet") else CsvSink(output_file)
+    total_rows = 0
+    done = 0
+    try:
+        for rows in search_chunks(queries, snapshot, model, top_k):
+            with span("io.write"):
+                sink.write(rows)
+            total_rows += len(rows)
+            done = min(len(queries), done + QUERY_CHUNK_SIZE)
+            print(f" -> Searched {done}/{len(queries)} queries", end='\r')
+            sys.stdout.flush()
+    finally:
+        sink.close()
+
+    search_time = time.time() - start_time - load_time
+    print(f"\n\n==============================================")
+    print(f"[COMPLETE] Batch Search Finished.")
+    print(f"Queries: {len(queries)}  |  Result rows: {total_rows}")
+    print(f"Load: {load_time:.1f}s  |  Search: {search_time:.2f}s ({len(queries) / max(search_time, 1e-9):.0f} queries/s)")
+    print(f"Results saved to: {output_file}")
+    print(f"==============================================")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen a file of queries against the BioSearch index.")
+    parser.add_argument("input", help="Queries: .txt (one per line) or .csv (query[,category][,repository])")
+    parser.add_argument("output", help="Results: .csv or .parquet")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Results kept per query")
+    parser.add_argument("--threads", type=int, default=0, help="FAISS OpenMP threads (0 = FAISS default)")
+    args = parser.parse_args()
+    init("batch_search")
+
+    if not os.path.exists(args.input):
+        print(f"[!] Input file {args.input} not found.")
+        sys.exit(1)
+    run_batch_search(args.input, args.output, top_k=args.top_k, threads=args.threads)
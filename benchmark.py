@@ -0,0 +1,274 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Intermediates"))
+from synthetic_corpus import SEED, LABELLED_QUERIES, synthetic_patents, full_text, step4_rows, step5_rows
+from search_engine import MODEL_NAME, SEARCH_DEPTH, TOP_K, FacetIndex, collect_hits, search_index
+
+RESULTS_DIR = "bench_results"
+CORPUS_SIZES = [1000, 10000]
+BENCHMARKS = ["extract", "context", "polish", "embed", "search"]
+CONTEXT_WINDOW = 1000          # step3 CONTEXT_WINDOW
+EMBED_SAMPLE = 2000            # Documents encoded per size for throughput (the rest get random vectors)
+EMBED_DIM = 384                # all-MiniLM-L6-v2; used for random vectors when the model is unavailable
+SEARCH_QUERIES = 200
+RECALL_K = [1, 5, 10]
+REGRESSION_THRESHOLD = 0.10    # --compare fails on >10% worse throughput/latency/recall
+
+# ---------------------------------------------------------------- helpers
+
+def percentiles_ms(samples: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples) * 1000
+    return {"p50_ms": round(float(np.percentile(ms, 50)), 3), "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3)}
+
+def rate(n: int, seconds: float) -> float:
+    return round(n / max(seconds, 1e-9), 1)
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def search_metadata(rows: List[dict]) -> List[dict]:
+    return [{"accession_id": r["Accession_ID"], "repository": r["Repository"], "name": r["Bio_Name"],
+             "category": r["Bio_Category"], "application": r["Bio_Application"], "title": r["Title"]} for r in rows]
+
+# ---------------------------------------------------------------- per-stage benchmarks
+
+def bench_extract(patents: List[dict]) -> dict:
+    """step2 extract_accession_ids over every patent text, plus recall against the generator's ground truth."""
+    from step2_fetch_and_store_accession_numbers import extract_accession_ids
+    texts = [full_text(p) for p in patents]
+    start = time.perf_counter()
+    found = [set(extract_accession_ids(t)) for t in texts]
+    elapsed = time.perf_counter() - start
+
+    expected = hit = 0
+    missed_by_repo = {}
+    for p, got in zip(patents, found):
+        for deposit in p["_deposits"]:
+            expected += 1
+            if tuple(deposit) in got: hit += 1
+            else: missed_by_repo[deposit[0]] = missed_by_repo.get(deposit[0], 0) + 1
+    return {"docs": len(texts), "seconds": round(elapsed, 4), "docs_per_s": rate(len(texts), elapsed),
+            "mb_per_s": round(sum(map(len, texts)) / 1e6 / max(elapsed, 1e-9), 2),
+            "deposits": expected, "deposit_recall": round(hit / max(expected, 1), 4), "missed_by_repository": missed_by_repo}
+
+def bench_context(patents: List[dict]) -> dict:
+    """step3 aggressive_context_extract for every ground-truth deposit."""
+    from step3_add_context_snippet_of_open_source_non_duplicates import aggressive_context_extract
+    pairs = [(full_text(p), acc_id) for p in patents for _, acc_id in p["_deposits"]]
+    start = time.perf_counter()
+    snippets = [aggressive_context_extract(text, acc_id, window=CONTEXT_WINDOW) for text, acc_id in pairs]
+    elapsed = time.perf_counter() - start
+    return {"calls": len(pairs), "seconds": round(elapsed, 4), "calls_per_s": rate(len(pairs), elapsed),
+            "snippet_hit_rate": round(sum(1 for s in snippets if s) / max(len(pairs), 1), 4)}
+
+def bench_polish(patents: List[dict], workdir: str) -> dict:
+    """step5 run_polish end to end (CSV in, CSV out) on Step4-shaped rows with rescuable failures."""
+    import step5_LLM_results_refining as step5
+    rows = step4_rows(patents)
+    step5.INPUT_FILE = os.path.join(workdir, "Step4_Output.csv")
+    step5.OUTPUT_FILE = os.path.join(workdir, "Step5_Output.csv")
+    pd.DataFrame(rows).to_csv(step5.INPUT_FILE, index=False)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        step5.run_polish()
+    elapsed = time.perf_counter() - start
+    polished = pd.read_csv(step5.OUTPUT_FILE)
+    return {"rows": len(rows), "seconds": round(elapsed, 4), "rows_per_s": rate(len(rows), elapsed),
+            "rescued": int((polished["LLM_Status"] == "Rescued").sum())}
+
+def bench_embed(rows: List[dict], model) -> tuple:
+    """step6 document encoding throughput on up to EMBED_SAMPLE rows. Returns (result, vectors or None)."""
+    if model is None:
+        return {"skipped": "sentence-transformers model unavailable"}, None
+    from step6_FAISS_embeddings import build_document
+    docs = [build_document(r) for r in rows[:EMBED_SAMPLE]]
+    start = time.perf_counter()
+    vecs = model.encode(docs, batch_size=64, show_progress_bar=False)
+    elapsed = time.perf_counter() - start
+    return {"docs": len(docs), "seconds": round(elapsed, 4), "docs_per_s": rate(len(docs), elapsed)}, np.asarray(vecs, dtype='float32')
+
+def corpus_vectors(n: int, encoded: Optional[np.ndarray], seed: int) -> np.ndarray:
+    """Encoded vectors where available, padded with random unit vectors up to n rows."""
+    rng = np.random.default_rng(seed)
+    dim = encoded.shape[1] if encoded is not None else EMBED_DIM
+    have = 0 if encoded is None else len(encoded)
+    pad = rng.standard_normal((max(0, n - have), dim)).astype('float32')
+    pad /= np.linalg.norm(pad, axis=1, keepdims=True)
+    return pad if encoded is None else np.vstack([encoded[:n], pad])
+
+def bench_search(vectors: np.ndarray, metadata: List[dict], model, seed: int) -> dict:
+    """Single-query and batched latency of IndexFlatL2 search + collect_hits, unfiltered and facet-filtered."""
+    import faiss
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    rng = np.random.default_rng(seed + 1)
+    queries = vectors[rng.integers(0, len(vectors), SEARCH_QUERIES)] + rng.normal(0, 0.05, (SEARCH_QUERIES, vectors.shape[1])).astype('float32')
+    k = min(SEARCH_DEPTH, index.ntotal)
+
+    def single(allow=None):
+        samples = []
+        for q in queries:
+            start = time.perf_counter()
+            D, I = search_index(index, q[None, :], k, allow)
+            collect_hits(D[0], I[0], metadata, top_k=TOP_K)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    facets = FacetIndex.from_metadata(metadata)
+    top_repo = max(facets.counts("repository").items(), key=lambda kv: kv[1])[0]
+    allow = facets.allow_mask({"repository": [top_repo]})
+
+    single()   # warm-up: page in the index and the metadata
+    result = {"vectors": index.ntotal, "k": k, "single": percentiles_ms(single()),
+              "filtered": dict(percentiles_ms(single(allow)), selectivity=round(float(allow.mean()), 4))}
+    start = time.perf_counter()
+    index.search(queries, k)
+    result["batch_queries_per_s"] = rate(len(queries), time.perf_counter() - start)
+    if model is not None:
+        result["recall"] = recall_at_k(index, metadata, model)
+    return result
+
+def recall_at_k(index, metadata: List[dict], model) -> dict:
+    """
+    Mean recall@k over LABELLED_QUERIES: hits whose application matches the query's label,
+    divided by min(k, relevant). Only the encoded prefix of the index carries real vectors.
+    """
+    encoded = min(EMBED_SAMPLE, len(metadata))
+    vecs = np.asarray(model.encode([q["query"] for q in LABELLED_QUERIES], show_progress_bar=False), dtype='float32')
+    D, I = index.search(vecs, max(RECALL_K))
+    scores = {f"recall@{k}": [] for k in RECALL_K}
+    for q, ids in zip(LABELLED_QUERIES, I):
+        relevant = sum(1 for m in metadata[:encoded] if m["application"] == q["application"])
+        if relevant == 0: continue
+        for k in RECALL_K:
+            hits = sum(1 for i in ids[:k] if 0 <= i < encoded and metadata[i]["application"] == q["application"])
+            scores[f"recall@{k}"].append(hits / min(k, relevant))
+    return {name: round(float(np.mean(v)), 4) if v else None for name, v in scores.items()}
+
+# ---------------------------------------------------------------- runner
+
+def load_bench_model():
+    try:
+        from search_engine import load_model
+        return load_model()
+    except Exception as e:   # missing package, no network for the model download, ...
+        print(f"[!] Embedding model unavailable ({e.__class__.__name__}: {e}). Embedding and recall are skipped.")
+        return None
+
+def run_benchmarks(sizes: List[int], selected: List[str], seed: int = SEED) -> dict:
+    from step2_fetch_and_store_accession_numbers import ALL_PATTERNS
+    model = load_bench_model() if "embed" in selected else None
+    results = {
+        "meta": {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"), "git_commit": git_commit(),
+                 "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                 "seed": seed, "model": MODEL_NAME if model is not None else None, "benchmarks": selected},
+        "sizes": {},
+    }
+    for n in sizes:
+        print(f"[*] Corpus of {n:,} patents (seed {seed})...")
+        patents = synthetic_patents(n, seed=seed, repositories=list(ALL_PATTERNS))
+        rows = step5_rows(patents)
+        size_result = {"patents": n, "deposits": len(rows)}
+
+        if "extract" in selected:
+            size_result["extract_accession_ids"] = bench_extract(patents)
+        if "context" in selected:
+            size_result["aggressive_context_extract"] = bench_context(patents)
+        if "polish" in selected:
+            with tempfile.TemporaryDirectory() as workdir:
+                size_result["step5_polish"] = bench_polish(patents, workdir)
+        encoded = None
+        if "embed" in selected:
+            size_result["embedding"], encoded = bench_embed(rows, model)
+        if "search" in selected and rows:
+            vectors = corpus_vectors(len(rows), encoded, seed)
+            size_result["search"] = bench_search(vectors, search_metadata(rows), model if encoded is not None else None, seed)
+
+        for name, r in size_result.items():
+            if isinstance(r, dict): print(f"    - {name}: {json.dumps(r)}")
+        results["sizes"][str(n)] = size_result
+    return results
+
+def flatten(d: dict, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for key, value in d.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict): out.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool): out[name] = value
+    return out
+
+def compare(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """
+    Metrics present in both runs: *_per_s and recall are higher-is-better, *_ms lower-is-better.
+    Returns the regressions beyond threshold.
+    """
+    old, new = flatten(baseline["sizes"]), flatten(current["sizes"])
+    regressions = []
+    if not baseline["sizes"].keys() & current["sizes"].keys():
+        print(f"[!] No corpus sizes in common with the baseline ({sorted(baseline['sizes'])}).")
+        return regressions
+    print(f"\n{'metric':<60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(old.keys() & new.keys()):
+        higher_better = name.endswith("_per_s") or ".recall" in name or name.endswith("_recall")
+        lower_better = name.endswith("_ms")
+        if not (higher_better or lower_better) or not old[name]: continue
+        change = (new[name] - old[name]) / old[name]
+        worse = -change if higher_better else change
+        flag = "  <-- REGRESSION" if worse > threshold else ""
+        print(f"{name:<60} {old[name]:>12} {new[name]:>12} {change:>+7.1%}{flag}")
+        if flag: regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the BioSearch pipeline stages on a seeded synthetic corpus.")
+    parser.add_argument("--sizes", default=",".join(map(str, CORPUS_SIZES)), help="Comma-separated corpus sizes (patents)")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"Comma-separated subset of {BENCHMARKS}")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help=f"Results JSON (default: {RESULTS_DIR}/bench_<timestamp>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a previous results JSON; exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Allowed relative slowdown for --compare")
+    args = parser.parse_args()
+
+    selected = [b.strip() for b in args.only.split(",") if b.strip()]
+    unknown = sorted(set(selected) - set(BENCHMARKS))
+    if unknown:
+        print(f"[!] Unknown benchmarks {unknown}. Choose from {BENCHMARKS}.")
+        sys.exit(2)
+    if args.compare and not os.path.exists(args.compare):
+        print(f"[!] Baseline {args.compare} not found.")
+        sys.exit(1)
+
+    results = run_benchmarks([int(s) for s in args.sizes.split(",")], selected, seed=args.seed)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[*] Results saved to: {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"\n[!] {len(regressions)} metric(s) regressed by more than {args.threshold:.0%}.")
+            sys.exit(1)
+        print("\n[*] No regressions.")
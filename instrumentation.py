@@ -0,0 +1,295 @@
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+# Shared timing / metrics layer for the pipeline steps, app.py and the serving scripts.
+# Stdlib only, and everything except the in-memory metrics is opt-in through env vars
+# (inherited by every stage run_pipeline.py starts):
+#   BIOSEARCH_LOG_JSON=path|-       JSON-lines events (spans, step summaries); "-" = stderr
+#   BIOSEARCH_METRICS_PORT=9464     Prometheus text on http://127.0.0.1:<port>/metrics
+#   BIOSEARCH_METRICS_FILE=path     Prometheus text written at exit (node_exporter textfile collector);
+#                                   "{stage}" in the path is replaced, e.g. metrics/{stage}.prom
+#   BIOSEARCH_PROFILE=dir           Sampling profiler; <dir>/<stage>-<pid>.folded written at exit
+
+LOG_JSON = os.environ.get("BIOSEARCH_LOG_JSON", "")
+METRICS_PORT = int(os.environ.get("BIOSEARCH_METRICS_PORT", "0"))
+METRICS_FILE = os.environ.get("BIOSEARCH_METRICS_FILE", "")
+PROFILE_DIR = os.environ.get("BIOSEARCH_PROFILE", "")
+PROFILE_INTERVAL_MS = float(os.environ.get("BIOSEARCH_PROFILE_INTERVAL_MS", "10"))
+METRIC_PREFIX = "biosearch_"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RESERVOIR_SIZE = 1024     # Recent samples kept per histogram for percentiles
+
+# ---------------------------------------------------------------- metrics
+
+class Histogram:
+    """Prometheus-style cumulative buckets plus a reservoir of recent samples for percentiles."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound: self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent: return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+class Registry:
+    """Counters and histograms keyed by (name, sorted labels). Every series gets the process's stage label."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, Histogram] = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted({"stage": STAGE, **labels}.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms: self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self.histograms.get(self._key(name, labels))
+
+    def snapshot(self) -> dict:
+        """Plain-dict view for JSON logs and the UI: totals, per-second rates and latency percentiles."""
+        elapsed = max(time.time() - self.started, 1e-9)
+        with self.lock:
+            counters = {_series(n, l): v for (n, l), v in self.counters.items()}
+            histograms = {_series(n, l): {"count": h.count, "sum": round(h.sum, 6), "p50": h.percentile(50),
+                                          "p95": h.percentile(95), "p99": h.percentile(99)}
+                          for (n, l), h in self.histograms.items()}
+        return {"uptime_s": round(elapsed, 3), "counters": counters,
+                "rates_per_s": {k: round(v / elapsed, 3) for k, v in counters.items()}, "histograms": histograms}
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name: lines.append(f"{METRIC_PREFIX}{name}{_labels(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                for (n, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                    if n != name: continue
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{_labels(labels + (('le', str(bound)),))} {count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{_labels(labels)} {h.sum}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+def _labels(labels: tuple) -> str:
+    if not labels: return ""
+    escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+def _series(name: str, labels: tuple) -> str:
+    extra = [f"{k}={v}" for k, v in labels if k != "stage"]
+    return name + (f"[{','.join(extra)}]" if extra else "")
+
+STAGE = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+metrics = Registry()
+
+def inc(name: str, value: float = 1, **labels):
+    metrics.inc(name, value, **labels)
+
+def observe(name: str, value: float, **labels):
+    metrics.observe(name, value, **labels)
+
+# ---------------------------------------------------------------- structured logs
+
+_log_lock = threading.Lock()
+_log_file = None
+
+def log_event(event: str, **fields):
+    """One JSON line per event when BIOSEARCH_LOG_JSON is set; a no-op otherwise."""
+    global _log_file, LOG_JSON
+    if not LOG_JSON: return
+    record = {"ts": round(time.time(), 6), "stage": STAGE, "pid": os.getpid(), "event": event, **fields}
+    line = json.dumps(record, default=str) + "\n"
+    with _log_lock:
+        try:
+            if _log_file is None:
+                _log_file = sys.stderr if LOG_JSON == "-" else open(LOG_JSON, "a", encoding="utf-8")
+            _log_file.write(line)
+            _log_file.flush()
+        except OSError as e:
+            print(f"[!] JSON log disabled, cannot write {LOG_JSON}: {e}")
+            LOG_JSON = ""
+
+# ---------------------------------------------------------------- spans
+
+_active_spans: Dict[int, list] = {}   # thread id -> open span names, read by the profiler
+
+@contextmanager
+def span(name: str, **labels):
+    """
+    Times a block into the span_seconds histogram (labels: span + the given ones),
+    counts span_errors_total on exceptions and logs a "span" event.
+    """
+    stack = _active_spans.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        metrics.inc("span_errors_total", span=name, error=error, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        metrics.observe("span_seconds", elapsed, span=name, **labels)
+        log_event("span", span=name, duration_ms=round(elapsed * 1000, 3), error=error, **labels)
+
+def record_http(response, endpoint: str):
+    """
+    Counts a requests response by status, plus the retries urllib3 made before it.
+    Labelled with the API operation (same as the http.post span) and the host it went
+    to, so mock-server runs are told apart from the real API.
+    """
+    host = urlsplit(getattr(response, "url", "") or "").netloc or "unknown"
+    metrics.inc("http_responses_total", endpoint=endpoint, host=host, status=str(getattr(response, "status_code", "error")))
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    history = getattr(retries, "history", None) or ()
+    if history: metrics.inc("http_retries_total", len(history), endpoint=endpoint, host=host)
+
+# ---------------------------------------------------------------- exporter
+
+def serve_metrics(handler: BaseHTTPRequestHandler):
+    """Writes the Prometheus text exposition; for handlers that also serve other paths (app readiness)."""
+    body = metrics.render_prometheus().encode("utf-8")
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/plain; version=0.0.4")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+def start_exporter(port: int = METRICS_PORT):
+    if not port: return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                serve_metrics(self)
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    except OSError as e:
+        print(f"[!] Metrics exporter disabled: port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+# ---------------------------------------------------------------- profiler
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack each PROFILE_INTERVAL_MS and aggregates them as folded
+    stacks ("span:<innermost span>;file:function;... count"), the input format of
+    flamegraph.pl and speedscope. Costs one sys._current_frames() call per interval.
+    """
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own: continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                spans = _active_spans.get(thread_id)
+                stack.append(f"span:{spans[-1] if spans else '-'}")
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def dump(self, out_dir: str) -> str:
+        self.stopped.set()
+        self.thread.join(timeout=1)
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"{STAGE}-{os.getpid()}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+# ---------------------------------------------------------------- lifecycle
+
+_initialised = False
+
+def init(stage: Optional[str] = None):
+    """
+    Called once at the top of each entry point: names the stage, starts the exporter and
+    profiler when enabled, and logs a "summary" event (plus the metrics file) at exit.
+    Safe to call again (Streamlit re-runs app.py on every interaction).
+    """
+    global STAGE, _initialised
+    if _initialised: return
+    _initialised = True
+    if stage: STAGE = stage
+    metrics.started = time.time()
+    start_exporter()
+    profiler = SamplingProfiler().start() if PROFILE_DIR else None
+
+    def finish():
+        log_event("summary", **metrics.snapshot())
+        if METRICS_FILE:
+            path = METRICS_FILE.replace("{stage}", STAGE)
+            try:
+                with open(path + ".tmp", "w") as f:
+                    f.write(metrics.render_prometheus())
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                # Metrics are best effort: never turn a finished stage into a failed one
+                print(f"[!] Could not write metrics file {path}: {e}")
+        if profiler:
+            try:
+                print(f"[*] Profile written to {profiler.dump(PROFILE_DIR)}")
+            except OSError as e:
+                print(f"[!] Could not write profile to {PROFILE_DIR}: {e}")
+    atexit.register(finish)
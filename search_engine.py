@@ -0,0 +1,509 @@
+import os
+import glob
+import json
+import hashlib
+import pickle
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from instrumentation import span, inc, serve_metrics
+
+# faiss and sentence_transformers (torch) are imported inside the loaders: importing
+# this module must stay cheap so the app shell renders before they are loaded.
+
+INDEX_FILE = "bio_faiss.index"
+META_FILE = "bio_meta.pkl"
+SUMMARY_FILE = "bio_summary.json"  # Facet counts + posting offsets, written by step6
+POSTINGS_FILE = "bio_postings.npy" # Sorted FAISS ids per facet value, written by step6
+FACETS = ["category", "repository", "year"]   # Facets missing from the metadata are skipped
+MODEL_NAME = "all-MiniLM-L6-v2"   # Must match step6 MODEL_NAME
+SEARCH_DEPTH = 100                # Candidates fetched per query before filtering
+TOP_K = 15
+# Published by step6 and served by the app. Resolved against the repo root (a relative
+# BIOSEARCH_SNAPSHOT_DIR too), so step6 running from Intermediates/ and the app agree.
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.environ.get("BIOSEARCH_SNAPSHOT_DIR", "snapshots"))
+CURRENT_POINTER = "CURRENT"         # File in SNAPSHOT_DIR naming the live version
+SNAPSHOT_POLL_S = 30
+READY_PORT = int(os.environ.get("BIOSEARCH_READY_PORT", "8599"))   # 0 disables the readiness endpoint
+WARMUP_TIMEOUT_S = 300
+CANDIDATE_CHUNK = 100       # First candidate fetch per query; doubles whenever a cursor runs past it
+CURSOR_CACHE_SIZE = 256     # Candidate lists kept for pagination (LRU)
+
+# GITHUB FIX (File Stitching)
+def reconstruct_file(filename):
+    if not os.path.exists(filename):
+        parts = sorted(glob.glob(f"{filename}.part*"))
+        if parts:
+            with open(filename, "wb") as outfile:
+                for part in parts:
+                    with open(part, "rb") as infile:
+                        outfile.write(infile.read())
+
+def load_index(path=INDEX_FILE):
+    import faiss
+    reconstruct_file(path)
+    return faiss.read_index(path)
+
+def load_metadata(path=META_FILE):
+    reconstruct_file(path)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def load_model(name=MODEL_NAME):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+def to_score(dist) -> float:
+    """L2 distance on normalised MiniLM vectors -> % match shown in the UI."""
+    return round((1 - float(dist)) * 100, 1)
+
+def collect_hits(distances, ids, metadata: List[dict], top_k: int = TOP_K,
+                 categories: Optional[List[str]] = None, repositories: Optional[List[str]] = None) -> List[Dict]:
+    """Turns one row of index.search() output into filtered, scored metadata hits."""
+    hits = []
+    for dist, idx in zip(distances, ids):
+        if idx < 0 or idx >= len(metadata): continue
+        item = metadata[idx]
+        if categories and item.get('category') not in categories: continue
+        if repositories and item.get('repository') not in repositories: continue
+        hits.append({**item, "score": to_score(dist)})
+        if len(hits) >= top_k: break
+    return hits
+
+def search_index(index, vecs, k, allow=None):
+    """
+    index.search(), optionally restricted to an allowlist: a bool mask over FAISS ids
+    (see FacetIndex.allow_mask). The mask is packed into a bitmap FAISS checks while
+    scanning, so every returned hit already satisfies the filters.
+    """
+    if allow is None:
+        with span("index.search", filtered="no"):
+            return index.search(vecs, k)
+    import faiss
+    k = min(k, int(allow.sum()))
+    if k == 0:
+        return np.zeros((len(vecs), 0), dtype='float32'), np.zeros((len(vecs), 0), dtype='int64')
+    bitmap = np.packbits(allow, bitorder='little')   # must outlive the search call
+    params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(allow), faiss.swig_ptr(bitmap)))
+    with span("index.search", filtered="yes"):
+        return index.search(vecs, k, params=params)
+
+def range_search_index(index, vec, min_score, allow=None):
+    """
+    Every hit scoring >= min_score (% match), best first, via FAISS range search.
+    Returns (distances, ids) for the single query vector.
+    """
+    # score = (1 - dist) * 100  =>  score >= min_score  <=>  dist <= 1 - min_score / 100
+    radius = float(np.nextafter(np.float32(1 - min_score / 100), np.float32(np.inf)))   # range_search is strict <
+    if radius <= 0:
+        return np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64')
+    if allow is None:
+        with span("index.range_search", filtered="no"):
+            lims, D, I = index.range_search(vec, radius)
+    else:
+        import faiss
+        bitmap = np.packbits(allow, bitorder='little')
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(allow), faiss.swig_ptr(bitmap)))
+        with span("index.range_search", filtered="yes"):
+            lims, D, I = index.range_search(vec, radius, params=params)
+    order = np.argsort(D[lims[0]:lims[1]], kind='stable')
+    return D[lims[0]:lims[1]][order], I[lims[0]:lims[1]][order]
+
+class CandidateList:
+    """
+    Ranked candidates for one query on one snapshot, cached for pagination.
+    Top-k mode fetches CANDIDATE_CHUNK hits and doubles k only when a page needs more,
+    so paging through N results costs ~2N instead of re-running with ever larger k per page.
+    Threshold mode (min_score) fetches everything above the threshold in one range search.
+    """
+    def __init__(self, snapshot, vec, allow=None, min_score=None):
+        self.snapshot = snapshot
+        self.vec = vec
+        self.allow = allow
+        self.limit = snapshot.index.ntotal if allow is None else int(allow.sum())
+        self.lock = threading.Lock()
+        if min_score is not None:
+            self.dists, self.ids = range_search_index(snapshot.index, vec, min_score, allow)
+            self.exhausted = True
+        else:
+            self.dists, self.ids = np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64')
+            self.exhausted = self.limit == 0
+
+    def ensure(self, n: int):
+        with self.lock:
+            while len(self.ids) < n and not self.exhausted:
+                k = min(self.limit, max(CANDIDATE_CHUNK, 2 * len(self.ids), n))
+                D, I = search_index(self.snapshot.index, self.vec, k, allow=self.allow)
+                valid = I[0] >= 0
+                self.dists, self.ids = D[0][valid], I[0][valid]
+                self.exhausted = k >= self.limit or len(self.ids) < k
+
+    def page(self, offset: int, limit: int):
+        """(hits, has_more) for candidates [offset, offset + limit)."""
+        self.ensure(offset + limit + 1)
+        end = offset + limit
+        hits = collect_hits(self.dists[offset:end], self.ids[offset:end], self.snapshot.metadata, top_k=limit)
+        return hits, len(self.ids) > end
+
+class SearchCache:
+    """
+    Cursor-based pagination over cached CandidateLists. A cursor ("<version>:<key>:<offset>")
+    continues on the candidate list (and snapshot) the first page came from, even if
+    a newer snapshot was swapped in meanwhile. Lists only pin the current and the previous
+    snapshot (like SnapshotManager); older ones are dropped on a swap. An evicted list is
+    rebuilt if its snapshot is still the one being served; otherwise the cursor is
+    rejected with CursorExpired, since resuming at its offset on another index would
+    repeat or skip hits.
+    """
+    def __init__(self, max_entries: int = CURSOR_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = []   # Snapshot versions whose lists are kept: [previous, current]
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(version, query, selections, min_score) -> str:
+        spec = json.dumps([version, query, {f: sorted(v) for f, v in (selections or {}).items() if v}, min_score], sort_keys=True)
+        return hashlib.sha1(spec.encode("utf-8")).hexdigest()[:16]
+
+    def search_page(self, snapshot, model, query: str, selections: Optional[Dict[str, List[str]]] = None,
+                    min_score: Optional[float] = None, cursor: Optional[str] = None, page_size: int = TOP_K):
+        """Returns (hits, next_cursor); next_cursor is None on the last page."""
+        with span("query", page="first" if cursor is None else "next"):
+            return self._search_page(snapshot, model, query, selections, min_score, cursor, page_size)
+
+    def _retain(self, version):
+        """Called with the lock held: on a swap, drop lists of versions older than the previous one."""
+        if self.versions and self.versions[-1] == version: return
+        self.versions = [v for v in self.versions if v != version][-1:] + [version]
+        for key in [k for k, c in self.entries.items() if c.snapshot.version not in self.versions]:
+            del self.entries[key]
+
+    def _search_page(self, snapshot, model, query, selections, min_score, cursor, page_size):
+        version, key, offset = snapshot.version, self.make_key(snapshot.version, query, selections, min_score), 0
+        if cursor:
+            version, key, offset = cursor.rsplit(":", 2)
+            offset = int(offset)
+
+        with self.lock:
+            self._retain(snapshot.version)
+            candidates = self.entries.get(key)
+            if candidates is not None: self.entries.move_to_end(key)
+
+        inc("search_cache_total", result="miss" if candidates is None else "hit")
+        if candidates is None:
+            if version != snapshot.version:
+                inc("search_cursor_expired_total")
+                raise CursorExpired(f"Cursor belongs to snapshot {version}, which is no longer served (now {snapshot.version})")
+            with span("model.encode"):
+                vec = model.encode([query]).astype('float32')
+            candidates = CandidateList(snapshot, vec, snapshot.facets.allow_mask(selections or {}), min_score)
+            with self.lock:
+                self.entries[key] = candidates
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+        hits, has_more = candidates.page(offset, page_size)
+        return hits, (f"{version}:{key}:{offset + page_size}" if has_more else None)
+
+class CursorExpired(LookupError):
+    """A "Load more" cursor whose snapshot was swapped out; restart the search from page one."""
+
+def build_facet_index(metadata: List[dict]):
+    """
+    Posting list per facet value: the sorted FAISS ids (= metadata positions) holding it.
+    Returns (summary, postings): summary has counts per facet value plus [start, end)
+    offsets into the single concatenated int32 postings array. step6 writes exactly this
+    as SUMMARY_FILE + POSTINGS_FILE.
+    """
+    lists = {facet: {} for facet in FACETS}
+    for i, m in enumerate(metadata):
+        if not isinstance(m, dict): continue
+        for facet in FACETS:
+            if m.get(facet) not in (None, ""):
+                lists[facet].setdefault(str(m[facet]), []).append(i)
+
+    summary = {"count": len(metadata), "postings": {}}
+    chunks, offset = [], 0
+    for facet in FACETS:
+        if not lists[facet]: continue
+        summary[facet] = {value: len(ids) for value, ids in lists[facet].items()}
+        summary["postings"][facet] = {}
+        for value, ids in sorted(lists[facet].items()):
+            summary["postings"][facet][value] = [offset, offset + len(ids)]
+            chunks.append(np.asarray(ids, dtype='int32'))
+            offset += len(ids)
+    postings = np.concatenate(chunks) if chunks else np.zeros(0, dtype='int32')
+    return summary, postings
+
+class FacetIndex:
+    """
+    Counts and posting lists (sorted FAISS ids) per facet value. Rendering facets is
+    O(facet values); filters become a bitmap AND instead of a metadata scan.
+    """
+    def __init__(self, summary: Dict, postings):
+        self.summary = summary
+        self.postings_array = postings
+        self.size = summary["count"]
+
+    @classmethod
+    def from_metadata(cls, metadata: List[dict]):
+        """Built in memory, for builds that predate the precomputed files."""
+        return cls(*build_facet_index(metadata))
+
+    @classmethod
+    def load(cls, base_dir: str, metadata: List[dict]):
+        """Precomputed files from step6 if present and matching the metadata, else built in memory."""
+        summary_path = os.path.join(base_dir, SUMMARY_FILE)
+        postings_path = os.path.join(base_dir, POSTINGS_FILE)
+        if os.path.exists(summary_path) and os.path.exists(postings_path):
+            with open(summary_path, "r") as f:
+                summary = json.load(f)
+            if summary.get("count") == len(metadata) and "postings" in summary:
+                return cls(summary, np.load(postings_path, mmap_mode='r'))
+        return cls.from_metadata(metadata)
+
+    def counts(self, facet: str) -> Dict[str, int]:
+        return self.summary.get(facet, {})
+
+    def postings(self, facet: str, value: str):
+        start, end = self.summary["postings"].get(facet, {}).get(value, (0, 0))
+        return self.postings_array[start:end]
+
+    def allow_mask(self, selections: Dict[str, List[str]]):
+        """
+        OR within a facet, AND across facets. Returns a bool mask over FAISS ids,
+        or None when nothing is selected (search everything).
+        """
+        mask = None
+        for facet, values in selections.items():
+            if not values: continue
+            facet_mask = np.zeros(self.size, dtype=bool)
+            for value in values:
+                facet_mask[self.postings(facet, value)] = True
+            mask = facet_mask if mask is None else (mask & facet_mask)
+        return mask
+
+class Snapshot:
+    """One immutable (index, metadata) build. Queries keep a reference for their whole run."""
+    def __init__(self, version, index, metadata, manifest=None, base_dir="."):
+        self.version = version
+        self.index = index
+        self.metadata = metadata
+        self.manifest = manifest or {}
+        self.facets = FacetIndex.load(base_dir, metadata)
+        self.loaded_at = time.time()
+
+def read_current_version(snapshot_dir=SNAPSHOT_DIR) -> Optional[str]:
+    pointer = os.path.join(snapshot_dir, CURRENT_POINTER)
+    if not os.path.exists(pointer): return None
+    with open(pointer, "r") as f:
+        return f.read().strip() or None
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_snapshot(version, snapshot_dir=SNAPSHOT_DIR, verify=True) -> Snapshot:
+    """Loads snapshots/<version>/, refusing it if checksums or the embedding model do not match."""
+    path = os.path.join(snapshot_dir, version)
+    with open(os.path.join(path, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+
+    model_name = manifest.get("build", {}).get("model_name", MODEL_NAME)
+    if model_name != MODEL_NAME:
+        raise ValueError(f"Snapshot {version} was embedded with {model_name}, app encodes with {MODEL_NAME}")
+    if verify:
+        for name, info in manifest["files"].items():
+            if file_sha256(os.path.join(path, name)) != info["sha256"]:
+                raise ValueError(f"Snapshot {version}: checksum mismatch for {name}")
+
+    import faiss
+    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+    with open(os.path.join(path, META_FILE), "rb") as f:
+        metadata = pickle.load(f)
+    return Snapshot(version, index, metadata, manifest, base_dir=path)
+
+def load_legacy_snapshot() -> Snapshot:
+    """The flat INDEX_FILE/META_FILE pair, for deployments without snapshots/."""
+    return Snapshot("legacy", load_index(), load_metadata())
+
+def load_current_snapshot(snapshot_dir=SNAPSHOT_DIR) -> Snapshot:
+    """The snapshot named by snapshots/CURRENT, or the legacy flat files when there is none."""
+    version = read_current_version(snapshot_dir)
+    return load_snapshot(version, snapshot_dir) if version else load_legacy_snapshot()
+
+class SnapshotManager:
+    """
+    Serves the snapshot named by snapshots/CURRENT and hot-swaps it when the pointer
+    moves: a daemon thread loads and verifies the new version off the request path,
+    then replaces the active reference in one assignment. In-flight queries finish on
+    the snapshot they started with. The replaced snapshot stays in memory, so flipping
+    CURRENT back (step6 --rollback) swaps instantly.
+    """
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, poll_s=SNAPSHOT_POLL_S):
+        self.snapshot_dir = snapshot_dir
+        self.poll_s = poll_s
+        self.active = None
+        self.previous = None
+        self.last_error = None
+        self.failed_version = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.active = load_current_snapshot(self.snapshot_dir)
+        self.thread = threading.Thread(target=self._watch, name="snapshot-watcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def current(self) -> Snapshot:
+        return self.active
+
+    def _swap(self, snapshot):
+        with self.lock:
+            self.previous, self.active = self.active, snapshot
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_s)
+            try:
+                self.check()
+            except Exception as e:
+                # Keep serving the active snapshot; don't re-verify the bad one every poll
+                self.failed_version = read_current_version(self.snapshot_dir)
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def check(self):
+        """One poll: swap if CURRENT names a version other than the active one."""
+        version = read_current_version(self.snapshot_dir)
+        if not version or version in (self.active.version, self.failed_version): return
+        if self.previous and self.previous.version == version:
+            self._swap(self.previous)
+        else:
+            self._swap(load_snapshot(version, self.snapshot_dir))
+        self.last_error = None
+
+    def status(self) -> Dict:
+        return {
+            "version": self.active.version,
+            "previous": self.previous.version if self.previous else None,
+            "vectors": self.active.index.ntotal,
+            "last_error": self.last_error,
+        }
+
+def load_summary(version: Optional[str] = None, snapshot_dir=SNAPSHOT_DIR) -> Dict:
+    """Header/sidebar data without touching faiss or the model: a small JSON file, or the pickle as a fallback."""
+    base = os.path.join(snapshot_dir, version) if version and version != "legacy" else "."
+    summary_path = os.path.join(base, SUMMARY_FILE)
+    if os.path.exists(summary_path):
+        with open(summary_path, "r") as f:
+            return json.load(f)
+    return FacetIndex.from_metadata(load_metadata(os.path.join(base, META_FILE))).summary
+
+class WarmUp:
+    """
+    Cold start off the render path. Two threads run side by side:
+      faiss import -> snapshot load
+      sentence_transformers import -> model load -> one throwaway encode
+    Per-phase timings (seconds) are kept for the UI and the readiness endpoint.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.timings = {}
+        self.errors = []
+        self.snapshots = None
+        self.model = None
+        self.ready = threading.Event()
+
+    def _phase(self, name, fn):
+        t0 = time.perf_counter()
+        with span("warmup", phase=name):
+            result = fn()
+        self.timings[name] = round(time.perf_counter() - t0, 3)
+        return result
+
+    def _load_index(self):
+        try:
+            self._phase("import_faiss", lambda: __import__("faiss"))
+            self.snapshots = self._phase("load_index_and_metadata", lambda: SnapshotManager().start())
+        except Exception as e:
+            self.errors.append(f"index: {type(e).__name__}: {e}")
+
+    def _load_model(self):
+        try:
+            self._phase("import_sentence_transformers", lambda: __import__("sentence_transformers"))
+            model = self._phase("load_model", load_model)
+            self._phase("first_encode", lambda: model.encode(["warm-up"]))
+            self.model = model
+        except Exception as e:
+            self.errors.append(f"model: {type(e).__name__}: {e}")
+
+    def _run(self):
+        workers = [threading.Thread(target=self._load_index, daemon=True),
+                   threading.Thread(target=self._load_model, daemon=True)]
+        for w in workers: w.start()
+        for w in workers: w.join()
+        self.timings["total"] = round(time.time() - self.started, 3)
+        self.ready.set()
+
+    def start(self):
+        threading.Thread(target=self._run, name="warm-up", daemon=True).start()
+        return self
+
+    def wait(self, timeout=WARMUP_TIMEOUT_S) -> bool:
+        """True once everything loaded without errors."""
+        return self.ready.wait(timeout) and not self.errors
+
+    def status(self) -> Dict:
+        status = {
+            "ready": self.ready.is_set() and not self.errors,
+            "warming_up": not self.ready.is_set(),
+            "errors": self.errors,
+            "timings_s": dict(self.timings),
+            "uptime_s": round(time.time() - self.started, 1),
+        }
+        if self.snapshots: status["snapshot"] = self.snapshots.status()
+        return status
+
+def start_readiness_server(warmup: WarmUp, port: int = READY_PORT):
+    """
+    GET /ready -> 200 once warm (503 while warming up or failed), body = warmup.status().
+    Lets an autoscaler hold traffic until the replica can answer a query.
+    GET /metrics -> Prometheus text from the instrumentation registry.
+    """
+    if not port: return None
+
+    class ReadyHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                serve_metrics(self)
+                return
+            if self.path not in ("/ready", "/health"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            status = warmup.status()
+            body = json.dumps(status).encode("utf-8")
+            self.send_response(200 if status["ready"] or self.path == "/health" else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), ReadyHandler)
+    except OSError as e:
+        print(f"[!] Readiness endpoint disabled: port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="readiness", daemon=True).start()
+    return server
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import numpy as np
+import faiss
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from instrumentation import init, inc, span
+from search_engine import SEARCH_DEPTH, SNAPSHOT_DIR, TOP_K, load_model, collect_hits, read_current_version
+
+SHARD_MANIFEST_FILE = "bio_shards.json"   # Written by step6 --shards N into the published snapshot
+BASE_PORT = 8700
+SHARD_TIMEOUT_S = 2.0
+MAX_INFLIGHT_PER_SHARD = 4   # Requests to one shard still running (e.g. past the deadline) before it is skipped
+STARTUP_TIMEOUT_S = 120
+
+def current_manifest(snapshot_dir=SNAPSHOT_DIR) -> str:
+    """The shard manifest of the snapshot named by snapshots/CURRENT, else the legacy flat file."""
+    version = read_current_version(snapshot_dir)
+    if version and os.path.exists(os.path.join(snapshot_dir, version, SHARD_MANIFEST_FILE)):
+        return os.path.join(snapshot_dir, version, SHARD_MANIFEST_FILE)
+    return SHARD_MANIFEST_FILE
+
+# ---------------------------------------------------------------- shard server
+
+def load_shard(manifest_file: str, shard_no: int):
+    with open(manifest_file, "r") as f:
+        manifest = json.load(f)
+    entry = manifest["shards"][shard_no]
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    index = faiss.read_index(os.path.join(base_dir, entry["index_file"]))
+    with open(os.path.join(base_dir, entry["meta_file"]), "rb") as f:
+        metadata = pickle.load(f)
+    return index, metadata
+
+def make_handler(shard_no: int, index, metadata):
+    class ShardHandler(BaseHTTPRequestHandler):
+        """
+        GET  /health -> {"shard", "ntotal"}
+        POST /search {"vectors": [[...], ...], "k": int}
+             -> {"shard", "results": [[{"dist", "meta"}, ...] per query]}
+        """
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"shard": shard_no, "ntotal": index.ntotal})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/search":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                vecs = np.asarray(request["vectors"], dtype='float32')
+                if vecs.ndim != 2 or vecs.shape[1] != index.d:
+                    raise ValueError(f"vectors must be a list of {index.d}-dimensional vectors, got shape {vecs.shape}")
+                k = min(int(request.get("k", SEARCH_DEPTH)), index.ntotal)
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {"error": str(e)})
+                return
+
+            results = []
+            if k > 0:
+                with span("index.search", filtered="no"):
+                    D, I = index.search(vecs, k)
+                for dists, ids in zip(D, I):
+                    results.append([{"dist": float(d), "meta": metadata[i]} for d, i in zip(dists, ids) if i >= 0])
+            else:
+                results = [[] for _ in range(len(vecs))]
+            self._send(200, {"shard": shard_no, "results": results})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ShardHandler
+
+def serve_shard(manifest_file: str, shard_no: int, port: int):
+    index, metadata = load_shard(manifest_file, shard_no)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(shard_no, index, metadata))
+    print(f"[*] Shard {shard_no}: {index.ntotal} vectors on http://127.0.0.1:{port}")
+    sys.stdout.flush()
+    server.serve_forever()
+
+# ---------------------------------------------------------------- coordinator
+
+def _post_json(url: str, payload: dict, timeout: float) -> dict:
+    req = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+class ShardCoordinator:
+    """
+    Scatters query vectors to every shard server, then merges the per-shard top-k
+    lists by distance. Shards that error or miss the deadline are reported and
+    skipped, so callers still get (partial) results.
+
+    A request that misses the deadline cannot be cancelled; it holds its pool thread
+    until the shard answers or the socket timeout (also `timeout`) fires. At most
+    MAX_INFLIGHT_PER_SHARD requests per shard run at once and the pool has exactly
+    that many threads per shard, so a slow shard is skipped ("overloaded") instead of
+    queueing work in front of the healthy ones.
+    """
+    def __init__(self, endpoints: List[str], timeout: float = SHARD_TIMEOUT_S, repositories: Optional[List[List[str]]] = None):
+        self.endpoints = [e.rstrip("/") for e in endpoints]
+        self.timeout = timeout
+        # Per-shard repository lists from the manifest (shard_by=repository) allow pruning
+        self.repositories = repositories
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(endpoints)) * MAX_INFLIGHT_PER_SHARD)
+        self.inflight = [0] * len(endpoints)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_manifest(cls, manifest_file: Optional[str] = None, base_port: int = BASE_PORT, timeout: float = SHARD_TIMEOUT_S):
+        with open(manifest_file or current_manifest(), "r") as f:
+            manifest = json.load(f)
+        endpoints = [f"http://127.0.0.1:{base_port + s['shard']}" for s in manifest["shards"]]
+        repositories = [s["repositories"] for s in manifest["shards"]] if manifest.get("shard_by") == "repository" else None
+        return cls(endpoints, timeout=timeout, repositories=repositories)
+
+    def search(self, vecs, k: int = SEARCH_DEPTH, repositories: Optional[List[str]] = None):
+        """
+        Returns (distances, metas, info): per query a merged list sorted by distance.
+        info = {"responded": [...], "failed": {shard: reason}, "skipped": [...], "partial": bool}
+        """
+        vecs = np.asarray(vecs, dtype='float32')
+        targets = list(range(len(self.endpoints)))
+        skipped = []
+        if repositories and self.repositories:
+            wanted = set(repositories)
+            skipped = [s for s in targets if not wanted & set(self.repositories[s])]
+            targets = [s for s in targets if s not in skipped]
+
+        payload = {"vectors": vecs.tolist(), "k": k}
+        futures, overloaded = {}, []
+        with span("scatter"):
+            for s in targets:
+                with self.lock:
+                    if self.inflight[s] >= MAX_INFLIGHT_PER_SHARD:
+                        overloaded.append(s)
+                        continue
+                    self.inflight[s] += 1
+                future = self.pool.submit(_post_json, f"{self.endpoints[s]}/search", payload, self.timeout)
+                future.add_done_callback(lambda _, s=s: self._release(s))
+                futures[future] = s
+            done, not_done = wait(futures, timeout=self.timeout)
+
+        merged = [[] for _ in range(len(vecs))]
+        info = {"responded": [], "failed": {s: "overloaded" for s in overloaded}, "skipped": skipped}
+        for future in not_done:
+            info["failed"][futures[future]] = "timeout"
+        for future in done:
+            shard = futures[future]
+            try:
+                response = future.result()
+            except Exception as e:
+                info["failed"][shard] = str(e)
+                continue
+            info["responded"].append(shard)
+            for q, hits in enumerate(response["results"]):
+                merged[q].extend((h["dist"], h["meta"]) for h in hits)
+
+        info["partial"] = bool(info["failed"])
+        inc("shard_responses_total", len(info["responded"]), result="ok")
+        inc("shard_responses_total", len(info["failed"]), result="failed")
+        distances, metas = [], []
+        for hits in merged:
+            hits.sort(key=lambda h: h[0])
+            distances.append([h[0] for h in hits[:k]])
+            metas.append([h[1] for h in hits[:k]])
+        return distances, metas, info
+
+    def _release(self, shard: int):
+        with self.lock:
+            self.inflight[shard] -= 1
+
+    def search_hits(self, vecs, top_k: int = TOP_K, depth: int = SEARCH_DEPTH, categories=None, repositories=None):
+        """Same output as search_engine.collect_hits, one list per query, plus the scatter info."""
+        distances, metas, info = self.search(vecs, k=depth, repositories=repositories)
+        results = []
+        for dists, shard_meta in zip(distances, metas):
+            results.append(collect_hits(dists, range(len(shard_meta)), shard_meta, top_k=top_k,
+                                        categories=categories, repositories=repositories))
+        return results, info
+
+# ---------------------------------------------------------------- local cluster
+
+def launch_local(manifest_file: str, base_port: int = BASE_PORT) -> List[subprocess.Popen]:
+    """Starts one shard server process per shard and waits until all report healthy."""
+    with open(manifest_file, "r") as f:
+        num_shards = json.load(f)["num_shards"]
+
+    procs = []
+    for shard in range(num_shards):
+        cmd = [sys.executable, os.path.abspath(__file__), "serve", "--manifest", manifest_file,
+               "--shard", str(shard), "--port", str(base_port + shard)]
+        procs.append(subprocess.Popen(cmd))
+
+    deadline = time.time() + STARTUP_TIMEOUT_S
+    pending = set(range(num_shards))
+    while pending and time.time() < deadline:
+        for shard in list(pending):
+            if procs[shard].poll() is not None:
+                raise RuntimeError(f"Shard {shard} exited with code {procs[shard].returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{base_port + shard}/health", timeout=1) as resp:
+                    if resp.status == 200: pending.discard(shard)
+            except OSError:
+                pass
+        time.sleep(0.2)
+    if pending:
+        for p in procs: p.terminate()
+        raise RuntimeError(f"Shards {sorted(pending)} did not start within {STARTUP_TIMEOUT_S}s")
+    return procs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve and query a sharded BioSearch index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Serve one shard")
+    p_serve.add_argument("--manifest", help="Default: the current snapshot's manifest")
+    p_serve.add_argument("--shard", type=int, required=True)
+    p_serve.add_argument("--port", type=int)
+
+    p_launch = sub.add_parser("launch", help="Run every shard as a local process")
+    p_launch.add_argument("--manifest", help="Default: the current snapshot's manifest")
+    p_launch.add_argument("--base-port", type=int, default=BASE_PORT)
+
+    p_query = sub.add_parser("query", help="Scatter-gather a text query across running shards")
+    p_query.add_argument("text")
+    p_query.add_argument("--manifest", help="Default: the current snapshot's manifest")
+    p_query.add_argument("--base-port", type=int, default=BASE_PORT)
+    p_query.add_argument("--timeout", type=float, default=SHARD_TIMEOUT_S)
+    p_query.add_argument("--top-k", type=int, default=TOP_K)
+    args = parser.parse_args()
+    # Resolved once: launch hands this exact path to every shard, so all serve one version
+    if not args.manifest: args.manifest = current_manifest()
+
+    init(f"shard{args.shard}" if args.command == "serve" else "shard_coordinator")
+    if args.command == "serve":
+        serve_shard(args.manifest, args.shard, args.port if args.port else BASE_PORT + args.shard)
+
+    elif args.command == "launch":
+        procs = launch_local(args.manifest, args.base_port)
+        print(f"[*] {len(procs)} shards up on ports {args.base_port}-{args.base_port + len(procs) - 1}. Ctrl+C to stop.")
+        try:
+            for p in procs: p.wait()
+        except KeyboardInterrupt:
+            for p in procs: p.terminate()
+
+    elif args.command == "query":
+        coordinator = ShardCoordinator.from_manifest(args.manifest, args.base_port, args.timeout)
+        with span("model.encode"):
+            vec = load_model().encode([args.text]).astype('float32')
+        start = time.time()
+        results, info = coordinator.search_hits(vec, top_k=args.top_k)
+        print(f"[*] {len(info['responded'])} shards answered in {(time.time() - start) * 1000:.0f} ms"
+              + (f" | PARTIAL, failed: {info['failed']}" if info["partial"] else ""))
+        for i, res in enumerate(results[0], 1):
+            print(f"{i:>2}. {res['score']:>5}%  {res['name']} ({res['category']})  {res['repository']} {res['accession_id']}")